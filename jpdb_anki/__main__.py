@@ -1,6 +1,6 @@
 """Command line tasks.
 
-Three tasks are currently available:
+The following tasks are currently available:
 
 - scraping: `python -m jpdb_anki -t scrape -vl $vocabulary-list-url
     Scrapes a vocabulary list from JPDB and creates an APKG file
@@ -14,20 +14,56 @@ Three tasks are currently available:
     Creates a note for an expression by searching JPDB.
     In the case of multiple search results from JPDB, the most 
     used word will be selected.
+    With -ef $file-of-expressions, creates a single APKG file with the
+    notes of all the expressions and lists those left out.
+
+- parsing: `python -m jpdb_anki -t parse -txt $text-file
+    Creates an APKG file with the words of a text file.
+
+- batch: `python -m jpdb_anki -t batch -vls $url1,$url2 -vlf $file-of-urls
+    Scrapes several vocabulary lists, fetching the entries they share
+    only once, and creates an APKG file per list, or a single one with
+    --combined. Failed entries are left out and retried with --resume.
+
+- pitch: `python -m jpdb_anki -t pitch
+    Builds or updates the pitch index after term banks are added or
+    changed in data/pitch. Only changed banks are parsed again.
+
+- serve: `python -m jpdb_anki -t serve --port 8765
+    Serves search, parse and export requests on a local HTTP server,
+    keeping the notes, caches, pitch index and NLP pipeline loaded.
+    See `jpdb_anki.server` for the endpoints.
+
+- archive: `python -m jpdb_anki -t archive --archive data/pages.zip
+    Adds the cached JPDB pages to a compressed page archive.
+
+- reparse: `python -m jpdb_anki -t reparse --archive data/pages.zip
+    Rebuilds the saved notes from the archived pages without any
+    request, after a fix of the field extraction.
 """
 
+import sys
+
 from absl import flags, app
 
-from jpdb_anki.anki import load_model
-from jpdb_anki.database import Database
-from jpdb_anki.fields import pitch
-from jpdb_anki.scraping import get_vocab_entry_from_search
+from jpdb_anki import cache, metrics, session
+from jpdb_anki.parallel import DEFAULT_WORKERS
 
 
 flags.DEFINE_enum(
     "task",
     "scrape",
-    ["generate", "scrape", "search", "parse"],
+    [
+        "generate",
+        "scrape",
+        "batch",
+        "search",
+        "parse",
+        "pitch",
+        "serve",
+        "archive",
+        "reparse",
+    ],
     "Select task to perform.",
     short_name="t",
 )
@@ -37,9 +73,34 @@ flags.DEFINE_string(
     "Url to JPDB vocabulary list. Url should finish with '/vocabulary-list",
     short_name="vl",
 )
+flags.DEFINE_list(
+    "vocablists",
+    [],
+    "Comma separated urls to JPDB vocabulary lists for the batch task.",
+    short_name="vls",
+)
+flags.DEFINE_string(
+    "vocablist_file",
+    None,
+    "Path to a file of JPDB vocabulary list urls, one per line, for the batch "
+    "task. Empty lines and lines starting with '#' are ignored.",
+    short_name="vlf",
+)
+flags.DEFINE_boolean(
+    "combined",
+    False,
+    "Boolean to write a single APKG file with all the lists of the batch task.",
+)
 flags.DEFINE_string(
     "expression", None, "Expression to search to create a note.", short_name="e"
 )
+flags.DEFINE_string(
+    "expression_file",
+    None,
+    "Path to a file of expressions to search, one per line, or '-' to read "
+    "them from stdin. Empty lines and lines starting with '#' are ignored.",
+    short_name="ef",
+)
 flags.DEFINE_string("text", None, "Path to a text file.", short_name="txt")
 flags.DEFINE_boolean(
     "overwrite",
@@ -47,29 +108,225 @@ flags.DEFINE_boolean(
     "Boolean to overwrite existing notes in database.",
     short_name="ow",
 )
+flags.DEFINE_boolean(
+    "resume",
+    False,
+    "Boolean to resume an interrupted scrape or batch task and retry failed "
+    "entries.",
+)
+flags.DEFINE_boolean(
+    "incremental",
+    False,
+    "Boolean to only write new or changed notes since the last export.",
+)
+flags.DEFINE_integer(
+    "max_frequency",
+    None,
+    "Only export the words whose JPDB frequency rank is at most this value.",
+)
+flags.DEFINE_integer(
+    "top", None, "Only export this number of most frequent words, in order."
+)
+flags.DEFINE_boolean(
+    "frequency_order",
+    False,
+    "Boolean to export the words from the most to the least frequent.",
+)
+flags.DEFINE_list(
+    "exclude_lists",
+    [],
+    "Comma separated urls to JPDB vocabulary lists or decks of known words, "
+    "whose words are not exported.",
+)
+flags.DEFINE_integer(
+    "workers",
+    DEFAULT_WORKERS,
+    "Number of notes fetched concurrently from JPDB.",
+    short_name="w",
+)
+flags.DEFINE_integer(
+    "nlp_processes",
+    1,
+    "Number of processes tokenizing the text of the parse task.",
+)
+flags.DEFINE_float(
+    "rate_limit",
+    session.DEFAULT_REQUESTS_PER_SECOND,
+    "Maximum number of requests per second sent to JPDB.",
+)
+flags.DEFINE_integer(
+    "burst",
+    session.DEFAULT_BURST,
+    "Number of requests sent at once to JPDB after an idle period.",
+)
+flags.DEFINE_float(
+    "timeout", session.DEFAULT_TIMEOUT, "Timeout of a request to JPDB in seconds."
+)
+flags.DEFINE_integer(
+    "retries",
+    session.DEFAULT_RETRIES,
+    "Maximum number of retries of a failed request to JPDB.",
+)
+flags.DEFINE_boolean(
+    "offline",
+    False,
+    "Boolean to only use cached JPDB pages and never send requests.",
+)
+flags.DEFINE_float(
+    "cache_ttl",
+    cache.DEFAULT_TTL / 3600,
+    "Number of hours a cached JPDB page is used without revalidation.",
+)
+flags.DEFINE_integer(
+    "cache_size",
+    cache.DEFAULT_MAX_BYTES >> 20,
+    "Maximum size of the cache of JPDB pages in MB.",
+)
+flags.DEFINE_integer(
+    "processes",
+    None,
+    "Number of processes of CPU-bound tasks. Defaults to the number of CPUs.",
+)
+flags.DEFINE_enum(
+    "html_parser",
+    None,
+    ["lxml", "html.parser"],
+    "HTML parser of JPDB pages. Defaults to lxml when it is installed.",
+)
+flags.DEFINE_boolean(
+    "metrics",
+    False,
+    "Boolean to time each stage of the task and print a summary at exit.",
+)
+flags.DEFINE_string(
+    "metrics_output",
+    None,
+    "Path to write the metrics at exit, as Prometheus text for a .prom file "
+    "or JSON otherwise. Implies --metrics.",
+)
+flags.DEFINE_string(
+    "archive",
+    None,
+    "Path to the archive of JPDB pages of the archive and reparse tasks. "
+    "Defaults to data/pages.zip.",
+)
+flags.DEFINE_string("host", "127.0.0.1", "Host address of the serve task.")
+flags.DEFINE_integer("port", 8765, "Port of the serve task.")
+flags.DEFINE_boolean(
+    "dry_run",
+    False,
+    "Boolean to load what the task needs and exit without running it.",
+)
 FLAGS = flags.FLAGS
 
 
 def main(_):
-    db = Database(pitch_dictionary=pitch.load_pitch_dictionary(), model=load_model())
+    if FLAGS.metrics or FLAGS.metrics_output:
+        metrics.enable(output=FLAGS.metrics_output)
+
+    # Modules are imported by the tasks that use them, to start quickly
+    if FLAGS.task == "pitch":
+        from jpdb_anki.fields import pitch
+
+        if not FLAGS.dry_run:
+            pitch.build_pitch_index(processes=FLAGS.processes)
+        return
+
+    if FLAGS.task == "archive":
+        from jpdb_anki import archive
+
+        if not FLAGS.dry_run:
+            path = FLAGS.archive or archive.ARCHIVE_PATH
+            print(archive.export_cache(path), "pages archived in", path)
+        return
+
+    from jpdb_anki import scraping
+    from jpdb_anki.anki import load_model
+    from jpdb_anki.database import Database
+
+    # The pitch dictionary is loaded with the first note to fetch
+    db = Database(model=load_model())
     db.overwrite = FLAGS.overwrite
+    db.incremental = FLAGS.incremental
+    db.workers = FLAGS.workers
+    db.nlp_processes = FLAGS.nlp_processes
+    db.max_frequency = FLAGS.max_frequency
+    db.top = FLAGS.top
+    db.frequency_order = FLAGS.frequency_order
+    db.exclude_lists = FLAGS.exclude_lists
+    if FLAGS.html_parser:
+        scraping.html_parser = FLAGS.html_parser
+
+    jpdb_session = session.get_session()
+    jpdb_session.scheduler.requests_per_second = FLAGS.rate_limit
+    jpdb_session.scheduler.burst = FLAGS.burst
+    jpdb_session.timeout = FLAGS.timeout
+    jpdb_session.retries = FLAGS.retries
+
+    response_cache = cache.get_cache()
+    response_cache.offline = FLAGS.offline
+    response_cache.ttl = FLAGS.cache_ttl * 3600
+    response_cache.max_bytes = FLAGS.cache_size << 20
+
+    if FLAGS.dry_run:
+        return
 
     if FLAGS.task == "scrape":
-        vocab_entries = db.get_list(FLAGS.vocablist)
-        db.write_apkg_from_list("output.apkg", vocab_entries)
+        db.scrape_list("output.apkg", FLAGS.vocablist, resume=FLAGS.resume)
+
+    elif FLAGS.task == "batch":
+        urls = list(FLAGS.vocablists)
+        if FLAGS.vocablist_file:
+            with open(FLAGS.vocablist_file, "r") as file:
+                lines = (line.strip() for line in file)
+                urls += [line for line in lines if line and not line.startswith("#")]
+        if not urls:
+            raise app.UsageError(
+                "The batch task needs --vocablists or --vocablist_file."
+            )
+        db.scrape_lists(
+            urls,
+            combined_filepath="output.apkg" if FLAGS.combined else None,
+            resume=FLAGS.resume,
+        )
 
     elif FLAGS.task == "generate":
         db.write_apkg_from_db("output.apkg")
 
+    elif FLAGS.task == "search" and FLAGS.expression_file:
+        if FLAGS.expression_file == "-":
+            lines = [line.strip() for line in sys.stdin]
+        else:
+            with open(FLAGS.expression_file, "r", encoding="utf-8") as file:
+                lines = [line.strip() for line in file]
+        expressions = [line for line in lines if line and not line.startswith("#")]
+        db.write_apkg_from_searches("output.apkg", expressions)
+
     elif FLAGS.task == "search":
         # db.get_note(get_vocab_entry_from_search(FLAGS.expression))
-        db.write_apkg_from_search("output.apkg", FLAGS.expression)
+        with session.priority(session.INTERACTIVE):
+            db.write_apkg_from_search("output.apkg", FLAGS.expression)
         print("Note successfully generated.")
 
     elif FLAGS.task == "parse":
         db.write_apkg_from_text("output.apkg", FLAGS.text)
         print(f"APKG for {FLAGS.text} successfully generated.")
 
+    elif FLAGS.task == "serve":
+        from jpdb_anki import server
+
+        server.serve(db, host=FLAGS.host, port=FLAGS.port)
+
+    elif FLAGS.task == "reparse":
+        from jpdb_anki import archive
+
+        db.reparse_archive(
+            FLAGS.archive or archive.ARCHIVE_PATH, processes=FLAGS.processes
+        )
+
+    if jpdb_session.stats.requests:
+        print("JPDB:", jpdb_session.stats)
+
 
 if __name__ == "__main__":
     app.run(main)
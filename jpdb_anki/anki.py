@@ -1,8 +1,18 @@
+import hashlib
+import itertools
+import json
 import os
 import pathlib
+import sqlite3
+import tempfile
+import time
+import zipfile
 
 import genanki
+from genanki.apkg_col import APKG_COL
+from genanki.apkg_schema import APKG_SCHEMA
 
+from jpdb_anki import metrics
 from jpdb_anki.fields import note
 
 
@@ -69,7 +79,14 @@ class AnkiNote(genanki.Note):
     def guid(self):
         return genanki.guid_for(self.fields[0], self.fields[1])
 
+    @property
+    def content_hash(self) -> str:
+        """A hash of the fields and model, to detect changed notes."""
+        content = "\x1f".join([str(self.model.model_id), *self.fields])
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
     @classmethod
+    @metrics.timed("anki.from_note")
     def from_note(cls, note: note.Note, *, model: genanki.Model | None = None):
         expression = note.expression
         try:
@@ -100,3 +117,82 @@ class AnkiNote(genanki.Note):
                 examples,
             ],
         )
+
+
+class PackageWriter:
+    """Writes an APKG file while notes are added.
+
+    Notes are inserted into the collection SQLite by batches as they are
+    added, instead of being kept in a `genanki.Deck` until the package is
+    written, so memory does not grow with the number of notes. The APKG file
+    is written on `close`, also when an error interrupts the export, with
+    the notes added so far.
+
+    Example:
+        with PackageWriter("output.apkg", deck_id, "Python deck", model) as writer:
+            for anki_note in anki_notes:
+                writer.add_note(anki_note)
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        deck_id: int,
+        name: str,
+        model: genanki.Model,
+        *,
+        batch_size: int = 500,
+    ) -> None:
+        self.filepath = filepath
+        self.deck_id = deck_id
+        self.batch_size = batch_size
+        self.n_notes = 0
+
+        self._pending: list[genanki.Note] = []
+        self._timestamp = time.time()
+        self._id_gen = itertools.count(int(self._timestamp * 1000))
+
+        dbfile, self._dbfilename = tempfile.mkstemp()
+        os.close(dbfile)
+        self._connection = sqlite3.connect(self._dbfilename)
+        cursor = self._connection.cursor()
+        cursor.executescript(APKG_SCHEMA)
+        cursor.executescript(APKG_COL)
+
+        deck = genanki.Deck(deck_id, name)
+        deck.add_model(model)
+        deck.write_to_db(cursor, self._timestamp, self._id_gen)
+        self._connection.commit()
+
+    def add_note(self, anki_note: genanki.Note) -> None:
+        self._pending.append(anki_note)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    @metrics.timed("package.flush")
+    def flush(self) -> None:
+        """Inserts the pending notes in one transaction."""
+        cursor = self._connection.cursor()
+        for anki_note in self._pending:
+            anki_note.write_to_db(cursor, self._timestamp, self.deck_id, self._id_gen)
+        self._connection.commit()
+        self.n_notes += len(self._pending)
+        self._pending.clear()
+
+    @metrics.timed("package.write")
+    def close(self) -> None:
+        """Writes the APKG file with all the added notes, if any."""
+        self.flush()
+        self._connection.close()
+
+        if self.n_notes:
+            with zipfile.ZipFile(self.filepath, "w") as outzip:
+                outzip.write(self._dbfilename, "collection.anki2")
+                outzip.writestr("media", json.dumps({}))
+        os.remove(self._dbfilename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,200 @@
+"""A single-file archive of raw JPDB pages, to rebuild notes without network.
+
+The archive is a zip file with one compressed member per page, named by its
+url. The central directory of the zip indexes the pages, so a page is read
+without decompressing the others. A page whose content changed is appended
+again, and its last copy is read.
+
+Example:
+    archive.export_cache(archive.ARCHIVE_PATH)
+    with archive.PageArchive(pathlib.Path(archive.ARCHIVE_PATH)) as pages:
+        content = pages.get(url)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import pathlib
+import shutil
+from typing import Iterable, Iterator
+import warnings
+import zipfile
+import zlib
+
+from jpdb_anki import scraping
+from jpdb_anki.cache import get_cache
+from jpdb_anki.fields import note, pitch
+
+ARCHIVE_PATH = os.path.join("data", "pages.zip")
+
+REPARSE_CHUNK_SIZE = 16
+COMPRESSION_LEVEL = 9
+
+
+class PageArchive:
+    """A read-only archive of pages keyed by url."""
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self._zip = zipfile.ZipFile(path, "r")
+
+    def __contains__(self, url: str) -> bool:
+        try:
+            self._zip.getinfo(url)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self.urls())
+
+    def urls(self) -> list[str]:
+        return list(dict.fromkeys(self._zip.namelist()))
+
+    def get(self, url: str) -> bytes:
+        """Reads the content of a page.
+
+        Raises:
+            KeyError: The page is not archived.
+        """
+        return self._zip.read(url)
+
+    def close(self) -> None:
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def write_archive(path: pathlib.Path, pages: Iterable[tuple[str, bytes]]) -> int:
+    """Adds pages to an archive.
+
+    Only the pages that are new or whose content changed are compressed and
+    appended, the archived pages are not compressed again. Replaced copies
+    are dropped once they outnumber the pages of the archive.
+
+    The pages are appended to a copy of the archive, so an interrupted export
+    leaves the previous archive intact.
+
+    Returns:
+        The number of pages in the archive.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    archived, n_members = {}, 0
+    if path.exists():
+        with zipfile.ZipFile(path, "r") as previous:
+            for info in previous.infolist():
+                archived[info.filename] = (info.CRC, info.file_size)
+                n_members += 1
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    archive = None
+    try:
+        for url, content in pages:
+            checksum = (zlib.crc32(content), len(content))
+            if archived.get(url) == checksum:
+                continue
+            if archive is None:
+                if path.exists():
+                    shutil.copyfile(path, tmp_path)
+                archive = zipfile.ZipFile(
+                    tmp_path,
+                    "a",
+                    compression=zipfile.ZIP_DEFLATED,
+                    compresslevel=COMPRESSION_LEVEL,
+                )
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", "Duplicate name")
+                archive.writestr(url, content)
+            n_members += 1
+            archived[url] = checksum
+    except BaseException:
+        if archive is not None:
+            archive.close()
+            os.remove(tmp_path)
+        raise
+
+    if archive is None:
+        return len(archived)
+    archive.close()
+    if n_members > 2 * len(archived):
+        compact_archive(tmp_path)
+    os.replace(tmp_path, path)
+    return len(archived)
+
+
+def compact_archive(path: pathlib.Path) -> None:
+    """Rewrites an archive with the last copy of each page only."""
+    compact_path = path.with_name(path.name + ".compact")
+    with zipfile.ZipFile(path, "r") as archive, zipfile.ZipFile(
+        compact_path,
+        "w",
+        compression=zipfile.ZIP_DEFLATED,
+        compresslevel=COMPRESSION_LEVEL,
+    ) as compact:
+        for url in dict.fromkeys(archive.namelist()):
+            compact.writestr(url, archive.read(url))
+    os.replace(compact_path, path)
+
+
+def export_cache(path: str) -> int:
+    """Adds the pages of the response cache to an archive."""
+    return write_archive(pathlib.Path(path), get_cache().items())
+
+
+# State of each reparse process, opened once by `_init_reparse`
+_archive: PageArchive | None = None
+_pitch_dictionary: pitch.PitchIndex | dict | None = None
+
+
+def _init_reparse(
+    path: str, pitch_dictionary: pitch.PitchIndex | dict | str, html_parser: str
+) -> None:
+    global _archive, _pitch_dictionary
+    _archive = PageArchive(pathlib.Path(path))
+    # SQLite connections are not shared with the parent process
+    if isinstance(pitch_dictionary, str):
+        pitch_dictionary = pitch.PitchIndex(pathlib.Path(pitch_dictionary))
+    _pitch_dictionary = pitch_dictionary
+    scraping.html_parser = html_parser
+
+
+def _reparse_page(url: str) -> note.Note | str:
+    try:
+        jpdb = scraping.parse_html(_archive.get(url))
+        return note.Note.from_soup(jpdb, url, pitch_dictionary=_pitch_dictionary)
+    except Exception as e:
+        return repr(e)
+
+
+def reparse(
+    path: str,
+    urls: Iterable[str],
+    *,
+    pitch_dictionary: pitch.PitchIndex | dict,
+    processes: int | None = None,
+) -> Iterator[tuple[str, note.Note | str]]:
+    """Creates the notes of archived vocabulary pages with a pool of processes.
+
+    Args:
+        path: The path of the archive.
+        urls: The urls of archived vocabulary pages.
+        pitch_dictionary: The pitch dictionary of the notes. A pitch index is
+            opened again by each process.
+        processes: The number of processes. Defaults to the number of CPUs.
+    Yields:
+        Each url in order, with its note or the error raised parsing its page
+        as a string.
+    """
+    urls = list(urls)
+    if isinstance(pitch_dictionary, pitch.PitchIndex):
+        pitch_dictionary = str(pitch_dictionary.path)
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_reparse,
+        initargs=(path, pitch_dictionary, scraping.html_parser),
+    ) as executor:
+        results = executor.map(_reparse_page, urls, chunksize=REPARSE_CHUNK_SIZE)
+        yield from zip(urls, results)
@@ -0,0 +1,455 @@
+"""Benchmarks on recorded JPDB pages.
+
+Fixture pages are the html files of `data/fixtures`. Vocabulary pages
+cached by previous runs can be recorded as fixtures with
+`python -m jpdb_anki.bench --record`.
+
+- suite: `python -m jpdb_anki.bench -b all -o bench.json`
+    Times each stage of the scraping pipeline and writes the throughput,
+    p50/p99 latency and peak memory of each stage as JSON, to compare
+    versions. A single stage is run with its name, eg `-b write_apkg`.
+    Pages are served by a local stub server from the fixtures, and the
+    notes, cache and packages are written to a temporary directory, so
+    the benchmarks never touch JPDB or the data of the user.
+
+    load_url: fetching and parsing a page with `load_url`.
+    from_jpdb: creating a note with `Note.from_jpdb`.
+    pitch: `Pitch.from_expression_and_reading` on term bank entries.
+    pitch_svg: rendering a pitch graph without the `pitch_svg` cache.
+    anki_note: converting a note with `AnkiNote.from_note`.
+    pitch_dictionary: opening the pitch index with `load_pitch_dictionary`.
+    write_apkg: `write_apkg_from_list` on a list of `--notes` new entries.
+    startup: `python -m jpdb_anki -t $task --dry_run` for each task, the
+        time to start the interpreter, import and initialize what the task
+        uses, and exit.
+
+- parse: `python -m jpdb_anki.bench -b parse`
+    Compares the time to parse a page and extract its note fields for
+    each available HTML parser, with one `find` per field and with the
+    single-pass extractor.
+"""
+
+import contextlib
+import datetime
+import http.server
+import itertools
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, Iterator, NamedTuple
+
+from absl import app, flags
+from bs4 import BeautifulSoup
+import yaml
+
+from jpdb_anki import scraping
+from jpdb_anki.anki import AnkiNote, load_model
+from jpdb_anki.cache import get_cache
+from jpdb_anki.database import Database
+from jpdb_anki.fields import examples, meanings, note, pitch, spelling
+from jpdb_anki.scraping import default_html_parser, load_url
+from jpdb_anki.session import get_session
+
+FIXTURES_DIRECTORY = os.path.join("data", "fixtures")
+BENCH_DECK_ID = 1234567890
+
+TASKS = [
+    "generate",
+    "scrape",
+    "batch",
+    "search",
+    "parse",
+    "pitch",
+    "serve",
+    "archive",
+    "reparse",
+]
+
+STAGES = [
+    "load_url",
+    "from_jpdb",
+    "pitch",
+    "pitch_svg",
+    "anki_note",
+    "pitch_dictionary",
+    "write_apkg",
+]
+
+flags.DEFINE_enum(
+    "benchmark",
+    "all",
+    ["all", "parse", "startup", *STAGES],
+    "Select benchmark to run.",
+    short_name="b",
+)
+flags.DEFINE_integer("repeat", 20, "Number of runs per fixture page.")
+flags.DEFINE_integer(
+    "notes", 100, "Number of notes of the write_apkg and pitch benchmarks."
+)
+flags.DEFINE_string(
+    "output", None, "Path to the JSON file of the results.", short_name="o"
+)
+flags.DEFINE_boolean(
+    "record", False, "Boolean to record cached vocabulary pages as fixtures."
+)
+FLAGS = flags.FLAGS
+
+
+def load_fixtures() -> dict[str, bytes]:
+    return {
+        path.name: path.read_bytes()
+        for path in sorted(pathlib.Path(FIXTURES_DIRECTORY).glob("*.html"))
+    }
+
+
+def record_fixtures() -> int:
+    """Copies the cached vocabulary pages into the fixtures directory."""
+    os.makedirs(FIXTURES_DIRECTORY, exist_ok=True)
+    n_pages = 0
+    for url, content in get_cache().items():
+        if "/vocabulary/" not in url:
+            continue
+        name = "vocabulary_" + "_".join(url.split("/")[-2:]) + ".html"
+        pathlib.Path(FIXTURES_DIRECTORY, name).write_bytes(content)
+        n_pages += 1
+    return n_pages
+
+
+def available_parsers() -> list[str]:
+    return ["html.parser"] + (["lxml"] if default_html_parser() == "lxml" else [])
+
+
+def time_calls(fn: Callable, args: list, repeat: int) -> list[float]:
+    """Times each call of a function in seconds."""
+    times = []
+    for _ in range(repeat):
+        for arg in args:
+            start = time.perf_counter()
+            fn(arg)
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def percentile(values: list[float], q: float) -> float:
+    """The nearest-rank percentile of a list of values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def extract_with_find(jpdb: BeautifulSoup) -> None:
+    """Extracts the note fields with one `find` per field."""
+    jpdb.find("title").text
+    jpdb.find("meta", attrs={"name": "description"}).attrs["content"]
+    jpdb.find(class_="tag tooltip")
+    spelling.get_spelling(jpdb)
+    [speech.text for speech in jpdb.find(class_="part-of-speech").contents]
+    meanings.get_meanings(jpdb)
+    examples.get_examples(jpdb)
+
+
+def extract_single_pass(jpdb: BeautifulSoup) -> None:
+    """Extracts the note fields with `note.find_sections`."""
+    sections = note.find_sections(jpdb)
+    sections["title"].text
+    sections["description"].attrs["content"]
+    sections.get("tag tooltip")
+    spelling.spelling_from_section(sections["primary-spelling"])
+    [speech.text for speech in sections["part-of-speech"].contents]
+    meanings.meanings_from_section(sections["subsection-meanings"])
+    examples.examples_from_section(sections.get("subsection-examples"))
+
+
+def bench_parse(fixtures: dict[str, bytes], repeat: int) -> None:
+    pages = list(fixtures.values())
+    print(f"{len(pages)} fixture pages, {repeat} runs, mean ms per page")
+    print(f"{'parser':<12} {'parse':>8} {'find':>8} {'single':>8} {'total':>8}")
+    for parser in available_parsers():
+        parse_times = time_calls(lambda p: BeautifulSoup(p, parser), pages, repeat)
+        soups = [BeautifulSoup(page, parser) for page in pages]
+        find_times = time_calls(extract_with_find, soups, repeat)
+        single_times = time_calls(extract_single_pass, soups, repeat)
+
+        parse = statistics.mean(parse_times) * 1000
+        find = statistics.mean(find_times) * 1000
+        single = statistics.mean(single_times) * 1000
+        print(
+            f"{parser:<12} {parse:>8.2f} {find:>8.2f} {single:>8.2f} "
+            f"{parse + single:>8.2f}"
+        )
+
+
+@contextlib.contextmanager
+def stub_server(fixtures: dict[str, bytes]) -> Iterator[str]:
+    """Serves the fixture pages on localhost, like JPDB vocabulary pages.
+
+    Any `/vocabulary/<id>/<name>` path is served, with the fixture page
+    `id % len(fixtures)`, so that every url of a benchmark is new to the
+    response cache.
+
+    Yields:
+        The base url of the server.
+    """
+    pages = list(fixtures.values())
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            parts = self.path.split("/")
+            if len(parts) != 4 or parts[1] != "vocabulary" or not parts[2].isdigit():
+                self.send_error(404)
+                return
+            page = pages[int(parts[2]) % len(pages)]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextlib.contextmanager
+def workspace() -> Iterator[pathlib.Path]:
+    """Runs in a temporary directory with the anki formats and pitch data.
+
+    The relative data paths of the package then point to a fresh note store,
+    response cache and exports, while the pitch index is shared.
+    """
+    cwd = pathlib.Path.cwd()
+    with tempfile.TemporaryDirectory() as directory:
+        root = pathlib.Path(directory)
+        (root / "data").mkdir()
+        for name in ("anki", "pitch"):
+            (root / "data" / name).symlink_to(cwd / "data" / name)
+        with (root / "config.yaml").open("w") as file:
+            yaml.dump({"deck_id": BENCH_DECK_ID}, file)
+
+        os.chdir(root)
+        try:
+            yield root
+        finally:
+            os.chdir(cwd)
+
+
+class Benchmark(NamedTuple):
+    """A function to time, and a factory of the arguments of one run."""
+
+    fn: Callable
+    make_args: Callable[[], list]
+    notes_per_call: int = 1
+
+
+def measure(benchmark: Benchmark, repeat: int) -> dict:
+    """Times the calls of a benchmark, then traces its memory in a last run.
+
+    Memory is traced in a separate run, as tracing slows down the calls.
+    """
+    times = []
+    for _ in range(repeat):
+        times += time_calls(benchmark.fn, benchmark.make_args(), 1)
+
+    tracemalloc.start()
+    for arg in benchmark.make_args():
+        benchmark.fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "calls": len(times),
+        "notes_per_second": len(times) * benchmark.notes_per_call / sum(times),
+        "p50_ms": percentile(times, 50) * 1000,
+        "p99_ms": percentile(times, 99) * 1000,
+        "peak_memory_mb": peak / (1 << 20),
+    }
+
+
+def make_benchmarks(
+    fixtures: dict[str, bytes], base_url: str, n_notes: int
+) -> dict[str, Benchmark]:
+    ids = itertools.count()
+
+    def new_urls(n: int) -> list[str]:
+        return [f"{base_url}/vocabulary/{i}/bench{i}" for i in itertools.islice(ids, n)]
+
+    def fixture_urls() -> list[str]:
+        return new_urls(len(fixtures))
+
+    pitch_dictionary = pitch.load_pitch_dictionary()
+    model = load_model()
+    notes = [
+        note.Note.from_soup(
+            scraping.parse_html(page), name, pitch_dictionary=pitch_dictionary
+        )
+        for name, page in fixtures.items()
+    ]
+
+    banks = sorted(pathlib.Path(pitch.PITCH_DATA_DIRECTORY).glob("term_meta_bank_*"))
+    rows = pitch.read_bank(str(banks[0]))[:n_notes] if banks else []
+    expressions_and_readings = [(row[0], row[1]) for row in rows]
+    readings_and_patterns = [(row[1], row[6]) for row in rows if row[6]]
+
+    def open_pitch_dictionary(_) -> None:
+        pitch._open_pitch_index.cache_clear()
+        pitch.load_pitch_dictionary()
+
+    def write_apkg(urls: list[str]) -> None:
+        db = Database(pitch_dictionary=pitch_dictionary, model=model)
+        db.write_apkg_from_list("bench.apkg", urls)
+        db.store.close()
+
+    return {
+        "load_url": Benchmark(load_url, fixture_urls),
+        "from_jpdb": Benchmark(
+            lambda url: note.Note.from_jpdb(url, pitch_dictionary=pitch_dictionary),
+            fixture_urls,
+        ),
+        "pitch": Benchmark(
+            lambda pair: pitch.Pitch.from_expression_and_reading(
+                *pair, pitch_dictionary=pitch_dictionary
+            ),
+            lambda: expressions_and_readings,
+        ),
+        "pitch_svg": Benchmark(
+            lambda pair: pitch._render.__wrapped__(*pair),
+            lambda: readings_and_patterns,
+        ),
+        "anki_note": Benchmark(
+            lambda note_: AnkiNote.from_note(note_, model=model), lambda: notes
+        ),
+        "pitch_dictionary": Benchmark(open_pitch_dictionary, lambda: [None]),
+        "write_apkg": Benchmark(
+            write_apkg, lambda: [new_urls(n_notes)], notes_per_call=n_notes
+        ),
+    }
+
+
+def bench_startup(repeat: int) -> dict:
+    """Times the start of each task in a new interpreter, in the workspace."""
+    path = [str(pathlib.Path(__file__).parents[1]), os.environ.get("PYTHONPATH")]
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, path))}
+    commands = {"interpreter": [sys.executable, "-c", "pass"]}
+    for task in TASKS:
+        commands[task] = [sys.executable, "-m", "jpdb_anki", "-t", task, "--dry_run"]
+
+    results = {}
+    print(f"{'startup':<18} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, command in commands.items():
+        run = lambda _: subprocess.run(command, env=env, check=True, text=True)
+        times = time_calls(run, [None], repeat)
+        result = results[name] = {
+            "runs": len(times),
+            "p50_ms": percentile(times, 50) * 1000,
+            "p99_ms": percentile(times, 99) * 1000,
+        }
+        print(f"{name:<18} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(
+    fixtures: dict[str, bytes],
+    stages: list[str],
+    repeat: int,
+    n_notes: int,
+    *,
+    startup: bool = False,
+) -> dict:
+    results = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "html_parser": scraping.html_parser,
+        "fixtures": len(fixtures),
+        "repeat": repeat,
+        "notes": n_notes,
+        "stages": {},
+    }
+
+    if startup:
+        with workspace():
+            results["startup"] = bench_startup(repeat)
+        if not stages:
+            return results
+
+    get_session().scheduler.requests_per_second = None
+    print(f"{'stage':<18} {'notes/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'MB':>7}")
+    with stub_server(fixtures) as base_url, workspace():
+        benchmarks = make_benchmarks(fixtures, base_url, n_notes)
+        for stage in stages:
+            # the full export runs a few times only, as it is much longer
+            runs = max(1, repeat // 10) if stage == "write_apkg" else repeat
+            result = measure(benchmarks[stage], runs)
+            results["stages"][stage] = result
+            print(
+                f"{stage:<18} {result['notes_per_second']:>10.1f} "
+                f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                f"{result['peak_memory_mb']:>7.2f}"
+            )
+        get_cache().close()
+
+    return results
+
+
+def main(_):
+    if FLAGS.record:
+        print(record_fixtures(), "fixture pages recorded.")
+        return
+
+    fixtures = load_fixtures()
+    if not fixtures:
+        raise app.UsageError(f"No fixture pages in {FIXTURES_DIRECTORY}.")
+
+    if FLAGS.benchmark == "parse":
+        bench_parse(fixtures, FLAGS.repeat)
+        return
+
+    if FLAGS.benchmark == "all":
+        stages = STAGES
+    elif FLAGS.benchmark == "startup":
+        stages = []
+    else:
+        stages = [FLAGS.benchmark]
+    output = pathlib.Path(FLAGS.output).absolute() if FLAGS.output else None
+    results = bench_suite(
+        fixtures,
+        stages,
+        FLAGS.repeat,
+        FLAGS.notes,
+        startup=FLAGS.benchmark in ("all", "startup"),
+    )
+
+    if output is not None:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with output.open("w") as file:
+            json.dump(results, file, indent=2)
+        print("Results written to", output)
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,208 @@
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Iterator
+import zlib
+
+from jpdb_anki import metrics
+from jpdb_anki.session import get_session
+
+CACHE_PATH = os.path.join("data", "cache.sqlite")
+
+DEFAULT_TTL = 7 * 24 * 3600.0
+DEFAULT_MAX_BYTES = 1 << 30
+EVICTION_BATCH_SIZE = 64
+
+
+class CacheMiss(KeyError):
+    """Raised when a page is not cached in offline mode."""
+
+
+class ResponseCache:
+    """An on-disk cache of JPDB pages keyed by URL.
+
+    Pages younger than `ttl` are served from the cache. Older pages are
+    revalidated with a conditional request using their ETag and
+    Last-Modified headers. Pages are stored compressed, and the least
+    recently used ones are evicted when the cache grows over `max_bytes`.
+
+    Attributes:
+        ttl: The number of seconds a page is served without revalidation.
+        max_bytes: The maximum size of the stored pages.
+        offline: If True, pages are only served from the cache.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        *,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        offline: bool = False,
+    ) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, "
+                "content BLOB NOT NULL, size INTEGER NOT NULL, etag TEXT, "
+                "last_modified TEXT, fetched_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+                "ON responses (accessed_at)"
+            )
+        # The size of the stored pages, kept up to date by this instance
+        (self._size,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    def lookup(self, url: str) -> tuple[bytes, str, str, float] | None:
+        """Reads a cached page and its validators without any request."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content, etag, last_modified, fetched_at FROM responses "
+                "WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        content, etag, last_modified, fetched_at = row
+        return zlib.decompress(content), etag, last_modified, fetched_at
+
+    def items(self) -> Iterator[tuple[str, bytes]]:
+        """Yields the url and content of every cached page."""
+        with self._lock:
+            urls = self._connection.execute("SELECT url FROM responses").fetchall()
+        for (url,) in urls:
+            cached = self.lookup(url)
+            if cached is not None:
+                yield url, cached[0]
+
+    def get(self, url: str) -> bytes:
+        """Gets the content of a page, from the cache when possible.
+
+        Raises:
+            CacheMiss: The page is not cached in offline mode.
+        """
+        cached = self.lookup(url)
+        now = time.time()
+
+        if cached is not None:
+            content, etag, last_modified, fetched_at = cached
+            if self.offline or now - fetched_at < self.ttl:
+                self._touch(url, now)
+                metrics.count("cache.hit")
+                return content
+        elif self.offline:
+            metrics.count("cache.miss")
+            raise CacheMiss(url)
+
+        headers = {}
+        if cached is not None and etag:
+            headers["If-None-Match"] = etag
+        if cached is not None and last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        response = get_session().get(url, headers=headers)
+        if cached is not None and response.status_code == 304:
+            self._touch(url, now, revalidated=True)
+            metrics.count("cache.revalidated")
+            return content
+
+        metrics.count("cache.miss")
+        self.put(
+            url,
+            response.content,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        return response.content
+
+    def put(
+        self,
+        url: str,
+        content: bytes,
+        *,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> None:
+        compressed = zlib.compress(content)
+        now = time.time()
+        with self._lock, self._connection:
+            self._size -= self._stored_size(url)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, compressed, len(compressed), etag, last_modified, now, now),
+            )
+            self._size += len(compressed)
+            self._evict()
+
+    def discard(self, url: str) -> None:
+        """Removes a page from the cache, if cached."""
+        with self._lock, self._connection:
+            self._size -= self._stored_size(url)
+            self._connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+
+    def _stored_size(self, url: str) -> int:
+        row = self._connection.execute(
+            "SELECT size FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _touch(self, url: str, now: float, *, revalidated: bool = False) -> None:
+        with self._lock, self._connection:
+            if revalidated:
+                self._connection.execute(
+                    "UPDATE responses SET accessed_at = ?, fetched_at = ? "
+                    "WHERE url = ?",
+                    (now, now, url),
+                )
+            else:
+                self._connection.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE url = ?", (now, url)
+                )
+
+    def _evict(self) -> None:
+        """Deletes the least recently used pages while over `max_bytes`."""
+        while self._size > self.max_bytes:
+            rows = self._connection.execute(
+                "SELECT url, size FROM responses ORDER BY accessed_at LIMIT ?",
+                (EVICTION_BATCH_SIZE,),
+            ).fetchall()
+            if not rows:
+                break
+            evicted = []
+            for url, page_size in rows:
+                if self._size <= self.max_bytes:
+                    break
+                evicted.append((url,))
+                self._size -= page_size
+            self._connection.executemany("DELETE FROM responses WHERE url = ?", evicted)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+_cache: ResponseCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """Returns the response cache shared by all the requests to JPDB."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(pathlib.Path(CACHE_PATH))
+        return _cache
@@ -1,32 +1,40 @@
+import collections
+import contextlib
+import hashlib
+import itertools
 import json
 import os
 import pathlib
-import pickle
+import threading
+from typing import Iterable, Iterator
 
 import genanki
 from tqdm import tqdm
 import yaml
 
-from jpdb_anki.anki import AnkiNote
-from jpdb_anki.fields import note
+from jpdb_anki import archive, metrics
+from jpdb_anki.anki import AnkiNote, PackageWriter
+from jpdb_anki.fields import note, pitch
+from jpdb_anki.jobs import JOBS_DIRECTORY, Job
+from jpdb_anki.parallel import DEFAULT_WORKERS, batched, ordered_map
 from jpdb_anki.scraping import (
-    get_all_vocab_entries,
+    SearchCache,
     get_vocab_entries_from_text,
     get_vocab_entry_from_search,
+    iter_vocab_entries,
+    resolve_expressions,
 )
+from jpdb_anki.store import NoteStore
 
-NOTES_DIRECTORY = os.path.join("data", "notes")
+NOTES_PATH = os.path.join("data", "notes.sqlite")
+NOTES_DIRECTORY = os.path.join("data", "notes")  # legacy, one pickle per note
 LISTS_DIRECTORY = os.path.join("data", "lists")
+SEARCH_CACHE_PATH = os.path.join("data", "search_cache.json")
+EXPORTS_DIRECTORY = os.path.join("data", "exports")
 
-
-def safe_pickle_load(path: pathlib.Path):
-    with path.open("rb") as file:
-        return pickle.load(file)
-
-
-def safe_pickle_dump(obj, path: pathlib.Path):
-    with path.open("wb") as file:
-        return pickle.dump(obj, file)
+NOTES_CHUNK_SIZE = 256
+NOTES_SAVE_SIZE = 16
+NO_SEARCH_RESULT = "no search result"
 
 
 def safe_json_dump(obj, path: pathlib.Path):
@@ -49,42 +57,98 @@ def list_key(url: str) -> str:
     return tmp[-2] + "_" + tmp[-1]
 
 
+def list_deck_id(deck_id: int, key: str) -> int:
+    """A stable id for the deck of a list, derived from the configured deck id
+    so that each list is imported to its own deck."""
+    digest = hashlib.sha256(f"{deck_id}/{key}".encode("utf-8")).digest()
+    return (1 << 30) + int.from_bytes(digest[:4], "big") % (1 << 30)
+
+
 def note_key(url: str) -> str:
     return url.split("/")[-1]
 
 
+def manifest_path(filepath: str) -> pathlib.Path:
+    """The path of the hashes of the notes exported to an apkg file."""
+    return pathlib.Path(EXPORTS_DIRECTORY, pathlib.Path(filepath).name + ".json")
+
+
+def write_search_report(path: pathlib.Path, left_out: dict[str, str]) -> None:
+    """Writes each expression left out of a package with its reason, one per
+    line and tab-separated, or removes the report if none was left out."""
+    if not left_out:
+        path.unlink(missing_ok=True)
+        return
+    lines = (f"{expression}\t{reason}\n" for expression, reason in left_out.items())
+    path.write_text("".join(lines), encoding="utf-8")
+
+
+def unique_entries(urls: Iterable[str]) -> Iterator[str]:
+    seen = set()
+    for url in urls:
+        key = note_key(url)
+        if key not in seen:
+            seen.add(key)
+            yield url
+
+
 class Database:
-    notes: dict[str, pathlib.Path]  # {expression: path / contains pickled note}
+    notes: set[str]  # {note key / note saved in store}, for membership only
+    fetched: set[str]  # {note key / note fetched by this instance}
     lists: dict[str, pathlib.Path]  # {url: path / contains json list of urls}
 
     def __init__(
         self,
         *,
-        pitch_dictionary: dict | None = None,
-        model: genanki.Model | None = None
+        pitch_dictionary: pitch.PitchIndex | dict | None = None,
+        model: genanki.Model | None = None,
     ) -> None:
-        self.pitch_dictionary = pitch_dictionary
+        self._pitch_dictionary = pitch_dictionary
+        self._pitch_lock = threading.Lock()
         self.model = model
         self.deck_id = safe_yaml_load(pathlib.Path("./config.yaml"))["deck_id"]
 
         self.overwrite = False
+        self.workers = DEFAULT_WORKERS
+        self.nlp_processes = 1
+        self.incremental = False
+
+        # Export filters, see `select_entries`
+        self.max_frequency: int | None = None
+        self.top: int | None = None
+        self.frequency_order = False
+        self.exclude_lists: list[str] = []
 
         self.load()
 
     def load(self) -> None:
-        os.makedirs(NOTES_DIRECTORY, exist_ok=True)
         os.makedirs(LISTS_DIRECTORY, exist_ok=True)
-        self.notes = {
-            note: pathlib.Path(os.path.join(NOTES_DIRECTORY, note))
-            for note in os.listdir(NOTES_DIRECTORY)
-        }
+        self.store = NoteStore(pathlib.Path(NOTES_PATH))
+        if os.path.isdir(NOTES_DIRECTORY):
+            print("Migrating notes from", NOTES_DIRECTORY, "to", NOTES_PATH)
+            n_notes = self.store.migrate_directory(NOTES_DIRECTORY)
+            print(n_notes, "notes migrated.")
+        self.notes = set(self.store.keys())
+        self.fetched = set()
+        self.search_cache = SearchCache(pathlib.Path(SEARCH_CACHE_PATH))
         self.lists = {
             list_: pathlib.Path(os.path.join(LISTS_DIRECTORY, list_))
             for list_ in os.listdir(LISTS_DIRECTORY)
         }
+        for key in self.lists.keys() - self.store.lists():
+            self.index_list(key, safe_json_load(self.lists[key]))
+
+    @property
+    def pitch_dictionary(self) -> pitch.PitchIndex | dict:
+        """The pitch dictionary, loaded on first use when none was given."""
+        with self._pitch_lock:
+            if self._pitch_dictionary is None:
+                self._pitch_dictionary = pitch.load_pitch_dictionary()
+            return self._pitch_dictionary
 
     def contains_note(self, key: str) -> bool:
-        return key in self.notes and not self.overwrite
+        """In overwrite mode, notes are only fetched once per instance."""
+        return key in self.notes and (not self.overwrite or key in self.fetched)
 
     def contains_list(self, key: str) -> bool:
         return key in self.lists
@@ -93,57 +157,432 @@ class Database:
         key = note_key(url)
 
         if self.contains_note(key):
-            return safe_pickle_load(self.notes[key])
+            metrics.count("note.hit")
+            return self.store.get(key)
 
-        path = pathlib.Path(os.path.join(NOTES_DIRECTORY, key))
-        self.notes[key] = path
+        metrics.count("note.miss")
 
-        note_ = note.Note.from_jpdb(url, pitch_dictionary=self.pitch_dictionary)
-        safe_pickle_dump(note_, path)
+        note_ = self.fetch_note(url)
+        self.store.put(key, note_)
+        self.notes.add(key)
+        self.fetched.add(key)
 
         return note_
 
+    def fetch_note(self, url: str) -> note.Note:
+        return note.Note.from_jpdb(url, pitch_dictionary=self.pitch_dictionary)
+
+    def fetch_note_or_error(self, url: str) -> note.Note | Exception:
+        try:
+            return self.fetch_note(url)
+        except Exception as e:
+            return e
+
+    def get_notes(self, urls: list[str], *, job: Job | None = None) -> list[note.Note]:
+        """Gets the notes of vocabulary entries.
+
+        Saved notes are read in one transaction. Missing notes are fetched
+        concurrently by `self.workers` threads, and written by batches of
+        `NOTES_SAVE_SIZE` as they arrive, so that the fetched notes are kept
+        when a fetch raises or the task is interrupted.
+
+        With a job, entries already fetched by the job are not fetched again
+        even in overwrite mode, and the fetch status of each entry is recorded
+        in the job. Entries whose fetch fails are left out instead of raising.
+
+        Args:
+            urls: A list of vocabulary entries.
+            job: An optional journal of a scraping job.
+        Returns:
+            The notes in the order of `urls`.
+        """
+        keys = [note_key(url) for url in urls]
+        done = job.done(urls) if job is not None else set()
+        notes = self.store.get_many(
+            k for k, url in zip(keys, urls) if self.contains_note(k) or url in done
+        )
+
+        missing = [(k, url) for k, url in zip(keys, urls) if k not in notes]
+        metrics.count("note.hit", len(keys) - len(missing))
+        metrics.count("note.miss", len(missing))
+        if missing:
+            # Loaded before the fetch threads start, as it may build the index
+            self.pitch_dictionary
+        fetched = ordered_map(
+            self.fetch_note if job is None else self.fetch_note_or_error,
+            [url for _, url in missing],
+            workers=self.workers,
+        )
+        failed = {}
+        unsaved = []
+        try:
+            for (k, url), result in zip(missing, fetched):
+                if isinstance(result, Exception):
+                    failed[url] = repr(result)
+                    continue
+                notes[k] = result
+                unsaved.append((k, result))
+                if len(unsaved) == NOTES_SAVE_SIZE:
+                    self.save_notes(unsaved)
+                    unsaved = []
+        finally:
+            self.save_notes(unsaved)
+            if job is not None:
+                done = (url for k, url in zip(keys, urls) if k in notes)
+                job.record_results(done, failed)
+
+        return [notes[k] for k in keys if k in notes]
+
+    def save_notes(self, items: list[tuple[str, note.Note]]) -> None:
+        """Writes fetched notes by key in one transaction."""
+        self.store.put_many(items)
+        self.notes.update(k for k, _ in items)
+        self.fetched.update(k for k, _ in items)
+
+    def iter_notes(
+        self, urls: Iterable[str], *, job: Job | None = None
+    ) -> Iterator[note.Note]:
+        """Yields the notes of vocabulary entries in order.
+
+        Entries are processed in chunks with `get_notes`, so that `urls` can
+        be a stream. Entries that appear several times are only yielded once.
+
+        Args:
+            urls: An iterable of vocabulary entries.
+            job: An optional journal of a scraping job.
+        """
+        for chunk in batched(unique_entries(urls), NOTES_CHUNK_SIZE):
+            yield from self.get_notes(chunk, job=job)
+
     def get_list(self, url: str) -> list[str]:
+        return list(self.iter_list(url))
+
+    def iter_list(self, url: str, *, job: Job | None = None) -> Iterator[str]:
+        """Yields the vocabulary entries of a list.
+
+        New lists are streamed as their pages are fetched, and saved once all
+        their pages are fetched.
+
+        Args:
+            url: The url of a JPDB vocabulary list.
+            job: An optional journal of a scraping job, that records fetched
+                pages and skips the pages it already recorded.
+        """
         key = list_key(url)
 
         if self.contains_list(key):
-            return safe_json_load(self.lists[key])
+            yield from safe_json_load(self.lists[key])
+            return
 
         print("Creating new list", key)
 
-        list_ = pathlib.Path(os.path.join(LISTS_DIRECTORY, key))
-        self.lists[key] = list_
+        if job is not None:
+            entries = job.iter_entries(url, workers=self.workers)
+        else:
+            entries = iter_vocab_entries(url, workers=self.workers)
+
+        vocab = []
+        for entry in entries:
+            vocab.append(entry)
+            yield entry
 
-        vocab = get_all_vocab_entries(url)
+        list_ = pathlib.Path(os.path.join(LISTS_DIRECTORY, key))
         safe_json_dump(vocab, list_)
+        self.lists[key] = list_
+        self.index_list(key, vocab)
 
         print("List", key, " created.")
 
-        return vocab
+    def index_list(self, key: str, urls: Iterable[str]) -> None:
+        """Indexes the entries of a list in the store, see `select_entries`."""
+        self.store.put_list(key, (note_key(url) for url in urls))
+
+    @property
+    def filtered(self) -> bool:
+        return bool(
+            self.max_frequency is not None
+            or self.top is not None
+            or self.frequency_order
+            or self.exclude_lists
+        )
+
+    def select_entries(
+        self, urls: Iterable[str], *, job: Job | None = None
+    ) -> list[str]:
+        """Filters and sorts vocabulary entries with the note metadata index.
+
+        Missing notes are fetched first, then entries are selected from the
+        metadata index of the store, without loading the notes:
+
+        - `max_frequency` drops entries with a larger frequency rank.
+        - `exclude_lists` drops the entries of these lists, eg known words.
+        - `top` keeps the `top` most frequent entries.
+
+        Entries are sorted from the most to the least frequent when `top` is
+        set or in `frequency_order`, and keep their order otherwise.
+
+        Args:
+            urls: An iterable of vocabulary entries.
+            job: An optional journal of a scraping job, see `get_notes`.
+        Returns:
+            The selected vocabulary entries.
+        """
+        urls = list(unique_entries(urls))
+        missing = [url for url in urls if not self.contains_note(note_key(url))]
+        collections.deque(self.iter_notes(missing, job=job), maxlen=0)
+
+        excluded = set()
+        for list_url in self.exclude_lists:
+            self.get_list(list_url)
+            excluded |= self.store.list_keys(list_key(list_url))
+
+        metadata = self.store.metadata(note_key(url) for url in urls)
+        selected = []
+        for url in urls:
+            key = note_key(url)
+            if key not in metadata or key in excluded:
+                continue
+            if (
+                self.max_frequency is not None
+                and metadata[key].frequency > self.max_frequency
+            ):
+                continue
+            selected.append(url)
+
+        if self.top is not None or self.frequency_order:
+            selected.sort(key=lambda url: metadata[note_key(url)].frequency)
+        if self.top is not None:
+            selected = selected[: self.top]
+
+        print(len(selected), "of", len(urls), "entries selected.")
+        return selected
 
     def write_apkg_from_db(self, filepath: str) -> None:
         """Writes the apkg file with all the current notes.
 
+        Notes are written in the stable order of the store, so that the new
+        cards keep their order in Anki from one export to the next.
+
         Args:
             filepath: A string path to the wanted apkg file location.
         """
-        return self.write_apkg_from_list(filepath, self.notes)
+        return self.write_apkg_from_list(filepath, self.store.keys())
 
-    def write_apkg_from_list(self, filepath: str, urls: list[str]) -> None:
+    def write_apkg_from_list(
+        self, filepath: str, urls: Iterable[str], *, job: Job | None = None
+    ) -> None:
         """Writes the apkg file from a list of vocabulary entries.
 
         This is also compatible with a list of expressions.
 
+        Missing notes are fetched concurrently, see `iter_notes`, and written
+        to the package by batches as they arrive.
+
+        In incremental mode, only the notes that are new or changed since the
+        previous export to the same file name are written. Importing this
+        delta package updates the deck, as notes are matched by guid.
+
+        When export filters are set, the entries are first selected with
+        `select_entries`.
+
         Args:
             filepath: A string path to the wanted apkg file location.
-            urls: A list of vocabulary entries.
+            urls: An iterable of vocabulary entries.
+            job: An optional journal of a scraping job, see `get_notes`.
         """
-        deck = genanki.Deck(self.deck_id, "Python deck")
-        for e in tqdm(urls, desc="Generating Package."):
-            deck.add_note(AnkiNote.from_note(self.get_note(e), model=self.model))
-        genanki.Package(deck).write_to_file(filepath)
+        if self.filtered:
+            urls = self.select_entries(urls, job=job)
+
+        manifest = self.load_manifest(filepath)
+
+        hashes = {}
+        with PackageWriter(filepath, self.deck_id, "Python deck", self.model) as writer:
+            notes = self.iter_notes(urls, job=job)
+            for note_ in tqdm(notes, desc="Generating Package."):
+                anki_note = AnkiNote.from_note(note_, model=self.model)
+                hashes[anki_note.guid] = anki_note.content_hash
+                if manifest.get(anki_note.guid) != hashes[anki_note.guid]:
+                    writer.add_note(anki_note)
+
+        if not writer.n_notes:
+            self.discard_package(filepath)
+            return
+
+        self.save_manifest(filepath, {**manifest, **hashes})
+        print("APKG successfully generated with", writer.n_notes, "notes.")
+
+    def discard_package(self, filepath: str) -> None:
+        """Removes the apkg file of a previous export when no note is written,
+        so that it is not imported again as the current export."""
+        pathlib.Path(filepath).unlink(missing_ok=True)
+        if self.incremental:
+            print(filepath, "has no new or changed notes, APKG not generated.")
+        else:
+            print(filepath, "has no notes to export, APKG not generated.")
+
+    def load_manifest(self, filepath: str) -> dict[str, str]:
+        """Loads the hashes of the previous export, in incremental mode only."""
+        path = manifest_path(filepath)
+        if self.incremental and path.exists():
+            return safe_json_load(path)
+        return {}
+
+    def save_manifest(self, filepath: str, manifest: dict[str, str]) -> None:
+        path = manifest_path(filepath)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        safe_json_dump(manifest, path)
+
+    def write_apkgs_from_lists(
+        self,
+        packages: dict[str, list[str]],
+        *,
+        decks: dict[str, tuple[int, str]] | None = None,
+        job: Job | None = None,
+    ) -> None:
+        """Writes several apkg files whose lists share vocabulary entries.
 
-        print("APKG successfully generated.")
+        The entries of all the lists are deduplicated before any fetch, so
+        that each note is fetched and converted once, then added to the
+        package of every list that contains it. See `write_apkg_from_list`
+        for the incremental mode.
+
+        Args:
+            packages: A dictionary mapping apkg file paths to their list of
+                vocabulary entries.
+            decks: An optional dictionary mapping apkg file paths to the id
+                and name of their deck. Defaults to the configured deck.
+            job: An optional journal of a scraping job, see `get_notes`.
+        """
+        decks = decks or {}
+        if self.filtered:
+            packages = {
+                filepath: self.select_entries(urls, job=job)
+                for filepath, urls in packages.items()
+            }
+
+        filepaths = collections.defaultdict(set)  # {note key: {apkg path}}
+        for filepath, urls in packages.items():
+            for url in urls:
+                filepaths[note_key(url)].add(filepath)
+        union = list(unique_entries(itertools.chain.from_iterable(packages.values())))
+        print(
+            len(packages),
+            "lists,",
+            sum(map(len, packages.values())),
+            "entries,",
+            len(union),
+            "unique entries.",
+        )
+
+        manifests = {filepath: self.load_manifest(filepath) for filepath in packages}
+        hashes = {filepath: {} for filepath in packages}
+        with contextlib.ExitStack() as stack:
+            writers = {
+                filepath: stack.enter_context(
+                    PackageWriter(
+                        filepath,
+                        *decks.get(filepath, (self.deck_id, "Python deck")),
+                        self.model,
+                    )
+                )
+                for filepath in packages
+            }
+            # Failed entries are left out with a job, notes are matched by url
+            notes = self.iter_notes(union, job=job)
+            for note_ in tqdm(notes, desc="Generating Packages.", total=len(union)):
+                anki_note = AnkiNote.from_note(note_, model=self.model)
+                for filepath in filepaths[note_key(note_.url)]:
+                    hashes[filepath][anki_note.guid] = anki_note.content_hash
+                    if (
+                        manifests[filepath].get(anki_note.guid)
+                        != anki_note.content_hash
+                    ):
+                        writers[filepath].add_note(anki_note)
+
+        for filepath, writer in writers.items():
+            if not writer.n_notes:
+                self.discard_package(filepath)
+                continue
+            self.save_manifest(filepath, {**manifests[filepath], **hashes[filepath]})
+            print(filepath, "successfully generated with", writer.n_notes, "notes.")
+
+    def scrape_lists(
+        self,
+        urls: list[str],
+        *,
+        combined_filepath: str | None = None,
+        resume: bool = False,
+    ) -> None:
+        """Writes the apkg files of several vocabulary lists as a resumable job.
+
+        The lists are fetched first, then the union of their entries is
+        fetched once, so the number of requests grows with the number of
+        unique entries rather than with the total length of the lists.
+
+        The fetch status of the entries is recorded in a job journal in
+        `JOBS_DIRECTORY`, named after the lists. An entry whose fetch fails is
+        left out of the packages instead of stopping the others, and is
+        retried when the job is resumed.
+
+        Args:
+            urls: The urls of JPDB vocabulary lists.
+            combined_filepath: If given, a single apkg file is written with
+                the notes of all the lists. Otherwise each list is written
+                to `<list key>.apkg`, in a deck named after the list.
+            resume: If False, the journal of a previous job is cleared.
+        """
+        lists = {url: self.get_list(url) for url in dict.fromkeys(urls)}
+        if combined_filepath is not None:
+            entries = itertools.chain.from_iterable(lists.values())
+            packages = {combined_filepath: list(unique_entries(entries))}
+            decks = {}
+        else:
+            packages, decks = {}, {}
+            for url, entries in lists.items():
+                key = list_key(url)
+                packages[key + ".apkg"] = entries
+                decks[key + ".apkg"] = (list_deck_id(self.deck_id, key), key)
+
+        keys = "\n".join(sorted(list_key(url) for url in lists))
+        job_name = "batch_" + hashlib.sha256(keys.encode("utf-8")).hexdigest()[:16]
+        job = Job(pathlib.Path(JOBS_DIRECTORY, job_name + ".sqlite"))
+        if not resume:
+            job.reset()
+
+        self.write_apkgs_from_lists(packages, decks=decks, job=job)
+
+        failed = job.failed()
+        if failed:
+            print(len(failed), "entries failed, run again with --resume to retry.")
+            for entry, error in failed[:10]:
+                print(" ", entry, error)
+        job.close()
+
+    def scrape_list(self, filepath: str, url: str, *, resume: bool = False) -> None:
+        """Writes the apkg file of a vocabulary list as a resumable job.
+
+        The pages of the list and the fetch status of its entries are
+        recorded in a job journal in `JOBS_DIRECTORY`. When resumed, the job
+        continues with the pages and entries it has not fetched yet, and
+        retries the entries that failed.
+
+        Args:
+            filepath: A string path to the wanted apkg file location.
+            url: The url of a JPDB vocabulary list.
+            resume: If False, the journal of a previous job is cleared.
+        """
+        job = Job(pathlib.Path(JOBS_DIRECTORY, list_key(url) + ".sqlite"))
+        if not resume:
+            job.reset()
+
+        self.write_apkg_from_list(filepath, self.iter_list(url, job=job), job=job)
+
+        failed = job.failed()
+        if failed:
+            print(len(failed), "entries failed, run again with --resume to retry.")
+            for entry, error in failed[:10]:
+                print(" ", entry, error)
+        job.close()
 
     def write_apkg_from_text(self, filepath: str, textpath: str) -> None:
         """Writes the apkg file with all the words in a given text.
@@ -152,9 +591,19 @@ class Database:
             filepath: A string path to the wanted apkg file location.
             textpath: A string path to the text to parse.
         """
+        failed = {}
         with open(textpath, "r") as file:
-            text = file.read()
-        vocab_entries = get_vocab_entries_from_text(text)
+            vocab_entries = get_vocab_entries_from_text(
+                file,
+                cache=self.search_cache,
+                workers=self.workers,
+                n_process=self.nlp_processes,
+                errors=failed,
+            )
+        if failed:
+            print(len(failed), "searches failed, their expressions are skipped.")
+            for expression, error in list(failed.items())[:10]:
+                print(" ", expression, error)
         self.write_apkg_from_list(filepath, vocab_entries)
 
     def write_apkg_from_search(self, filepath: str, expression: str) -> None:
@@ -164,6 +613,97 @@ class Database:
                 self.get_note(get_vocab_entry_from_search(expression)), model=self.model
             )
         )
-        genanki.Package(deck).write_to_file(filepath)
+        with metrics.timer("package.write"):
+            genanki.Package(deck).write_to_file(filepath)
 
         print("APKG successfully generated.")
+
+    def write_apkg_from_searches(
+        self, filepath: str, expressions: Iterable[str]
+    ) -> dict[str, str]:
+        """Writes the apkg file with the notes of many searched expressions.
+
+        Expressions are resolved concurrently through the search cache, then
+        their notes are fetched concurrently as a job, see `get_notes`, and
+        written to a single package. A search or fetch that fails leaves its
+        expression out of the package instead of stopping the others.
+
+        The expressions without any search result, and those whose search or
+        fetch failed with their error, are written to the report
+        `<filepath without suffix>.unresolved.txt` before the package is
+        written, then again with the failed fetches.
+
+        Args:
+            filepath: A string path to the wanted apkg file location.
+            expressions: An iterable of expressions.
+        Returns:
+            A dictionary mapping each expression left out of the package to
+            `NO_SEARCH_RESULT` or to its error.
+        """
+        left_out = {}
+        entries = resolve_expressions(
+            expressions, cache=self.search_cache, workers=self.workers, errors=left_out
+        )
+        n_expressions = len(entries) + len(left_out)
+        resolved = collections.defaultdict(list)  # {entry: [expression]}
+        for expression, entry in entries.items():
+            if entry is None:
+                left_out[expression] = NO_SEARCH_RESULT
+            else:
+                resolved[entry].append(expression)
+        n_resolved = sum(len(e) for e in resolved.values())
+        print(n_resolved, "of", n_expressions, "expressions resolved.")
+
+        report = pathlib.Path(filepath).with_suffix(".unresolved.txt")
+        write_search_report(report, left_out)
+        if not resolved:
+            return left_out
+
+        job_name = "search_" + pathlib.Path(filepath).stem + ".sqlite"
+        job = Job(pathlib.Path(JOBS_DIRECTORY, job_name))
+        job.reset()
+        self.write_apkg_from_list(filepath, list(resolved), job=job)
+        for entry, error in job.failed():
+            left_out.update((expression, error) for expression in resolved[entry])
+        job.close()
+
+        write_search_report(report, left_out)
+        if left_out:
+            print(len(left_out), "expressions left out, see", report)
+        return left_out
+
+    def reparse_archive(self, path: str, *, processes: int | None = None) -> None:
+        """Rebuilds the saved notes from an archive of their pages.
+
+        The archived pages are parsed again by a pool of processes without
+        any request, so that a fix of the field extraction applies to the
+        saved notes without fetching them again. Notes without an archived
+        page are left unchanged.
+
+        Args:
+            path: A string path to a page archive, see `archive.export_cache`.
+            processes: The number of parsing processes. Defaults to the
+                number of CPUs.
+        """
+        with archive.PageArchive(pathlib.Path(path)) as pages:
+            saved = (url for url in pages.urls() if note_key(url) in self.notes)
+            urls = list(unique_entries(saved))
+
+        results = archive.reparse(
+            path, urls, pitch_dictionary=self.pitch_dictionary, processes=processes
+        )
+        failed = {}
+        results = tqdm(results, desc="Reparsing notes.", total=len(urls))
+        for chunk in batched(results, NOTES_CHUNK_SIZE):
+            notes = {note_key(url): n for url, n in chunk if isinstance(n, note.Note)}
+            failed.update((url, n) for url, n in chunk if isinstance(n, str))
+            self.store.put_many(notes.items())
+            self.fetched.update(notes)
+
+        n_reparsed = len(urls) - len(failed)
+        n_unarchived = len(self.notes) - len(urls)
+        print(n_reparsed, "notes reparsed,", n_unarchived, "without archived page.")
+        if failed:
+            print(len(failed), "pages failed to parse.")
+            for url, error in list(failed.items())[:10]:
+                print(" ", url, error)
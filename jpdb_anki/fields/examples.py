@@ -1,9 +1,16 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
+
+from jpdb_anki import metrics
 
 
 def get_examples(jpdb: BeautifulSoup) -> list[tuple[str, str]]:
     """Extracts examples from JPDB page."""
-    examples = jpdb.find(class_="subsection-examples")
+    return examples_from_section(jpdb.find(class_="subsection-examples"))
+
+
+@metrics.timed("field.examples")
+def examples_from_section(examples: Tag | None) -> list[tuple[str, str]]:
+    """Extracts examples from the examples section of a JPDB page."""
     if not examples:
         return []
     examples = examples.find_all(class_="used-in")
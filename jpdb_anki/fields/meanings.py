@@ -1,12 +1,20 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
+
+from jpdb_anki import metrics
 
 
 def get_meanings(jpdb: BeautifulSoup) -> list[str]:
     """Extracts meanings from JPDB page."""
+    return meanings_from_section(jpdb.find(class_="subsection-meanings"))
+
+
+@metrics.timed("field.meanings")
+def meanings_from_section(subsection_meanings: Tag) -> list[str]:
+    """Extracts meanings from the meanings section of a JPDB page."""
     meanings = list(
         map(
             lambda x: x.text,
-            jpdb.find(class_="subsection-meanings").find_all(class_="description"),
+            subsection_meanings.find_all(class_="description"),
         )
     )
     return meanings
@@ -1,8 +1,72 @@
+import itertools
+import struct
+
+from bs4 import BeautifulSoup, Tag
+
+from jpdb_anki import metrics
 from jpdb_anki.fields import examples, meanings, pitch, spelling
 from jpdb_anki.scraping import load_url
 
+SECTION_CLASSES = (
+    "tag tooltip",
+    "primary-spelling",
+    "part-of-speech",
+    "subsection-meanings",
+    "subsection-examples",
+)
+
+# Binary format of a note: a header, the length of each string of the note,
+# then all the strings concatenated in UTF-8, see `Note.to_bytes`.
+NOTE_MAGIC = b"JPDBN"
+NOTE_FORMAT_VERSION = 1
+# magic, version, flags, frequency, meanings, examples, pitch mora
+NOTE_HEADER = struct.Struct("<5sBBqIII")
+HAS_PART_OF_SPEECH = 1
+HAS_PITCH = 2
+
+
+@metrics.timed("field.sections")
+def find_sections(jpdb: BeautifulSoup) -> dict[str, Tag]:
+    """Finds the tags holding the note fields of a JPDB page in one pass.
+
+    Returns:
+        A dictionary mapping "title", "description" and `SECTION_CLASSES` to
+        the first matching tag, as `find` would. Missing tags are left out.
+    """
+    sections = {}
+    n_sections = len(SECTION_CLASSES) + 2
+    for tag in jpdb.descendants:
+        if not isinstance(tag, Tag):
+            continue
+        if tag.name == "title":
+            sections.setdefault("title", tag)
+        elif tag.name == "meta" and tag.get("name") == "description":
+            sections.setdefault("description", tag)
+
+        classes = tag.get("class")
+        if classes:
+            for class_ in (" ".join(classes), *classes):
+                if class_ in SECTION_CLASSES:
+                    sections.setdefault(class_, tag)
+
+        if len(sections) == n_sections:
+            break
+    return sections
+
 
 class Note:
+    __slots__ = [
+        "expression",
+        "reading",
+        "frequency",
+        "spelling",
+        "part_of_speech",
+        "meanings",
+        "pitch",
+        "examples",
+        "url",
+    ]
+
     expression: str
     reading: str
     frequency: int
@@ -14,30 +78,131 @@ class Note:
     url: str
 
     @classmethod
-    def from_jpdb(cls, url: str, *, pitch_dictionary: dict | None = None):
-        jpdb = load_url(url)
+    @metrics.timed("note.from_jpdb")
+    def from_jpdb(
+        cls, url: str, *, pitch_dictionary: pitch.PitchIndex | dict | None = None
+    ):
+        return cls.from_soup(load_url(url), url, pitch_dictionary=pitch_dictionary)
+
+    @classmethod
+    def from_soup(
+        cls,
+        jpdb: BeautifulSoup,
+        url: str,
+        *,
+        pitch_dictionary: pitch.PitchIndex | dict | None = None,
+    ):
+        """Creates a note from a parsed JPDB page."""
+        sections = find_sections(jpdb)
 
         note = Note()
-        note.expression = jpdb.find("title").text.split(" ")[0]
-        note.reading = (
-            jpdb.find("meta", attrs={"name": "description"})
-            .attrs["content"]
-            .split(" ")[4][1:-1]
-        )
-        freq = jpdb.find(class_="tag tooltip")
+        note.expression = sections["title"].text.split(" ")[0]
+        note.reading = sections["description"].attrs["content"].split(" ")[4][1:-1]
+        freq = sections.get("tag tooltip")
         note.frequency = int(freq.text.split(" ")[-1]) if freq else 100000
-        note.spelling = spelling.get_spelling(jpdb)
+        note.spelling = spelling.spelling_from_section(sections["primary-spelling"])
 
         part_of_speech = ""
-        for speech in jpdb.find(class_="part-of-speech").contents:
+        for speech in sections["part-of-speech"].contents:
             part_of_speech += speech.text + "\n"
         note.part_of_speech = part_of_speech
 
-        note.meanings = meanings.get_meanings(jpdb)
+        note.meanings = meanings.meanings_from_section(sections["subsection-meanings"])
         note.pitch = pitch.Pitch.from_expression_and_reading(
             note.expression, note.reading, pitch_dictionary=pitch_dictionary
         )
-        note.examples = examples.get_examples(jpdb)
+        note.examples = examples.examples_from_section(
+            sections.get("subsection-examples")
+        )
         note.url = url
 
         return note
+
+    def __setstate__(self, state) -> None:
+        """Loads pickled notes, including the ones pickled without slots."""
+        if isinstance(state, tuple):
+            dict_state, slots_state = state
+            state = {**(dict_state or {}), **(slots_state or {})}
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def to_bytes(self) -> bytes:
+        """Serializes the note in the binary format `NOTE_FORMAT_VERSION`.
+
+        Notes created before the part of speech field keep it missing.
+        """
+        flags = 0
+        strings = [self.expression, self.reading, self.spelling, self.url]
+        part_of_speech = getattr(self, "part_of_speech", None)
+        if part_of_speech is not None:
+            flags |= HAS_PART_OF_SPEECH
+            strings.append(part_of_speech)
+        strings += self.meanings
+        for jp, en in self.examples:
+            strings += [jp, en]
+        n_mora = 0
+        if self.pitch is not None:
+            flags |= HAS_PITCH
+            n_mora = len(self.pitch.mora)
+            strings += [self.pitch.expression, self.pitch.spelling, self.pitch.html]
+            strings += self.pitch.mora
+
+        header = NOTE_HEADER.pack(
+            NOTE_MAGIC,
+            NOTE_FORMAT_VERSION,
+            flags,
+            self.frequency,
+            len(self.meanings),
+            len(self.examples),
+            n_mora,
+        )
+        lengths = struct.pack(f"<{len(strings)}I", *map(len, strings))
+        return header + lengths + "".join(strings).encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """Deserializes a note serialized by `to_bytes`.
+
+        Raises:
+            ValueError: The data is not a note in a supported format.
+        """
+        if not data.startswith(NOTE_MAGIC):
+            raise ValueError("Not a serialized note")
+        _, version, flags, frequency, n_meanings, n_examples, n_mora = (
+            NOTE_HEADER.unpack_from(data)
+        )
+        if version != NOTE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported note format version {version}")
+
+        has_pitch = flags & HAS_PITCH
+        n_strings = (
+            4
+            + int(bool(flags & HAS_PART_OF_SPEECH))
+            + n_meanings
+            + 2 * n_examples
+            + (3 + n_mora if has_pitch else 0)
+        )
+        lengths = struct.unpack_from(f"<{n_strings}I", data, NOTE_HEADER.size)
+        text = data[NOTE_HEADER.size + 4 * n_strings :].decode("utf-8")
+        ends = list(itertools.accumulate(lengths))
+        strings = iter([text[s:e] for s, e in zip([0, *ends], ends)])
+
+        note = Note()
+        note.expression = next(strings)
+        note.reading = next(strings)
+        note.spelling = next(strings)
+        note.url = next(strings)
+        if flags & HAS_PART_OF_SPEECH:
+            note.part_of_speech = next(strings)
+        note.frequency = frequency
+        note.meanings = list(itertools.islice(strings, n_meanings))
+        note.examples = [(next(strings), next(strings)) for _ in range(n_examples)]
+
+        note.pitch = None
+        if has_pitch:
+            note.pitch = pitch.Pitch()
+            note.pitch.expression = next(strings)
+            note.pitch.spelling = next(strings)
+            note.pitch.html = next(strings)
+            note.pitch.mora = list(strings)
+        return note
@@ -1,6 +1,20 @@
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import hashlib
 import json
+import multiprocessing
 import os
 import pathlib
+import re
+import sqlite3
+import threading
+
+from jpdb_anki import metrics
+
+PITCH_SVG_CACHE_SIZE = 8192
+
+COMBINERS = "ゃゅょぁぃぅぇぉャュョァィゥェォ"
+MORA_PATTERN = re.compile(f".[{COMBINERS}]?", re.DOTALL)
 
 # region Generate SVG from https://github.com/IllDepence/SVG_pitch
 
@@ -18,35 +32,7 @@ def hira_to_mora(hira: str) -> list[str]:
         out: ['しゅ', 'ん', 'か', 'しゅ', 'う', 'と', 'う']
     """
 
-    mora_arr = []
-    combiners = [
-        "ゃ",
-        "ゅ",
-        "ょ",
-        "ぁ",
-        "ぃ",
-        "ぅ",
-        "ぇ",
-        "ぉ",
-        "ャ",
-        "ュ",
-        "ョ",
-        "ァ",
-        "ィ",
-        "ゥ",
-        "ェ",
-        "ォ",
-    ]
-
-    i = 0
-    while i < len(hira):
-        if i + 1 < len(hira) and hira[i + 1] in combiners:
-            mora_arr.append("{}{}".format(hira[i], hira[i + 1]))
-            i += 2
-        else:
-            mora_arr.append(hira[i])
-            i += 1
-    return mora_arr
+    return MORA_PATTERN.findall(hira)
 
 
 def circle(x, y, o=False):
@@ -88,44 +74,50 @@ def path(x, y, typ, step_width):
 def pitch_svg(word: str, patt, silent=False):
     """Draw pitch accent patterns in SVG
 
+    Renders are cached by (word, pattern), so patt must be hashable.
+
     Examples:
         はし HLL (箸)
         はし LHL (橋)
         はし LHH (端)
     """
 
-    mora = hira_to_mora(word)
-
-    if len(patt) - len(mora) != 1 and not silent:
+    if not silent and len(patt) - len(hira_to_mora(word)) != 1:
         print(
             ("pattern should be number of morae + 1 (got: {}, {})").format(word, patt)
         )
+    return _render(word, patt)
+
+
+@functools.lru_cache(maxsize=PITCH_SVG_CACHE_SIZE)
+def _render(word: str, patt) -> str:
+    mora = hira_to_mora(word)
     positions = max(len(mora), len(patt))
     step_width = 35
     margin_lr = 16
     svg_width = max(0, ((positions - 1) * step_width) + (margin_lr * 2))
 
-    svg = (
-        '<svg class="pitch" width="{0}px" height="75px" viewBox="0 0 {0} 75' '">'
-    ).format(svg_width)
-    svg += '<rect width="{0}px" height="75px" style="fill:rgb(255,255,255);opacity:1"></rect>'.format(
-        svg_width
-    )
+    parts = [
+        (
+            '<svg class="pitch" width="{0}px" height="75px" viewBox="0 0 {0} 75' '">'
+        ).format(svg_width),
+        '<rect width="{0}px" height="75px" style="fill:rgb(255,255,255);opacity:1"></rect>'.format(
+            svg_width
+        ),
+    ]
 
-    chars = ""
     for pos, mor in enumerate(mora):
         x_center = margin_lr + (pos * step_width)
-        chars += text(x_center - 11, mor)
+        parts.append(text(x_center - 11, mor))
 
-    circles = ""
-    paths = ""
+    circles = []
     for pos, accent in enumerate(patt):
         x_center = margin_lr + (pos * step_width)
         if accent in ["H", "h", "1", "2"]:
             y_center = 5
         elif accent in ["L", "l", "0"]:
             y_center = 30
-        circles += circle(x_center, y_center, pos >= len(mora))
+        circles.append(circle(x_center, y_center, pos >= len(mora)))
         if pos > 0:
             if prev_center[1] == y_center:
                 path_typ = "s"
@@ -133,15 +125,13 @@ def pitch_svg(word: str, patt, silent=False):
                 path_typ = "d"
             elif prev_center[1] > y_center:
                 path_typ = "u"
-            paths += path(prev_center[0], prev_center[1], path_typ, step_width)
+            parts.append(path(prev_center[0], prev_center[1], path_typ, step_width))
         prev_center = (x_center, y_center)
 
-    svg += chars
-    svg += paths
-    svg += circles
-    svg += "</svg>"
+    parts += circles
+    parts.append("</svg>")
 
-    return svg
+    return "".join(parts)
 
 
 # endregion
@@ -160,13 +150,224 @@ def pitch_position_to_pattern(mora: list[str], position: int) -> str:
 
 
 PITCH_DATA_DIRECTORY = os.path.join("data", "pitch")
-PITCH_DICTIONARY_PATH = os.path.join(PITCH_DATA_DIRECTORY, "pitch_dictionary.json")
+PITCH_INDEX_PATH = os.path.join(PITCH_DATA_DIRECTORY, "pitch_index.sqlite")
+PITCH_INDEX_VERSION = 4
+
 
+class PitchIndex:
+    """A pitch dictionary backed by a SQLite index.
 
-def load_pitch_dictionary(*, alt_path: str | None = None) -> dict:
+    Lookups query the index on demand, so the dictionary is never loaded in
+    memory. It is accessed like the dictionary it replaces:
+    `index[expression][spelling]` is the first pitch position.
+
+    Every pitch variant of the term banks is indexed, with the moras of its
+    reading (separated by spaces) and its pitch pattern precomputed.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False
+        )
+
+    def __getitem__(self, expression: str) -> dict[str, int]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT reading, position FROM pitch WHERE expression = ? "
+                "ORDER BY bank, variant",
+                (expression,),
+            ).fetchall()
+        if not rows:
+            raise KeyError(expression)
+
+        positions = {}
+        for reading, position in rows:
+            positions.setdefault(reading, position)
+        return positions
+
+    def __contains__(self, expression: str) -> bool:
+        try:
+            self[expression]
+        except KeyError:
+            return False
+        return True
+
+    def get_positions(self, expression: str, reading: str) -> list[int]:
+        """Looks up all the pitch positions of an expression and reading."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT position FROM pitch WHERE expression = ? AND reading = ? "
+                "ORDER BY bank, variant",
+                (expression, reading),
+            ).fetchall()
+        return [position for position, in rows]
+
+    def get_mora_and_pattern(
+        self, expression: str, reading: str
+    ) -> tuple[list[str], str]:
+        """Looks up the moras of a reading and its first pitch pattern.
+
+        Raises:
+            KeyError: The index has no valid pattern for this reading.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT mora, pattern FROM pitch WHERE expression = ? "
+                "AND reading = ? ORDER BY bank, variant LIMIT 1",
+                (expression, reading),
+            ).fetchone()
+        if row is None or row[1] is None:
+            raise KeyError((expression, reading))
+        mora, pattern = row
+        return mora.split(" ") if mora else [], pattern
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    @classmethod
+    def build(
+        cls,
+        path: pathlib.Path,
+        directory: str = PITCH_DATA_DIRECTORY,
+        *,
+        processes: int | None = None,
+    ):
+        """Builds or updates the index from the term banks of a directory.
+
+        The checksum of each indexed bank is recorded, so that only new or
+        changed banks are parsed again, in a pool of processes. Each bank is
+        updated in its own transaction. An index with an outdated version is
+        rebuilt from scratch.
+
+        Args:
+            path: The path to the index.
+            directory: The directory of the term banks.
+            processes: The number of processes parsing banks.
+        """
+        connection = sqlite3.connect(path)
+        (version,) = connection.execute("PRAGMA user_version").fetchone()
+        if version != PITCH_INDEX_VERSION:
+            with connection:
+                connection.execute("DROP TABLE IF EXISTS pitch")
+                connection.execute("DROP TABLE IF EXISTS banks")
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS pitch (expression TEXT, reading TEXT, "
+                "bank TEXT, variant INTEGER, position INTEGER, mora TEXT, "
+                "pattern TEXT, PRIMARY KEY (expression, reading, bank, variant)) "
+                "WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS banks (name TEXT PRIMARY KEY, "
+                "checksum TEXT NOT NULL)"
+            )
+
+        checksums = {
+            bank_file: file_checksum(os.path.join(directory, bank_file))
+            for bank_file in sorted(os.listdir(directory))
+            if "term_meta_bank" in bank_file
+        }
+        indexed = dict(connection.execute("SELECT name, checksum FROM banks"))
+        changed = [name for name in checksums if indexed.get(name) != checksums[name]]
+        removed = [name for name in indexed if name not in checksums]
+
+        with connection:
+            for name in removed:
+                connection.execute("DELETE FROM pitch WHERE bank = ?", (name,))
+                connection.execute("DELETE FROM banks WHERE name = ?", (name,))
+
+        paths = [os.path.join(directory, name) for name in changed]
+        # Spawned rather than forked, as the index may be built while other
+        # threads of the task are fetching pages
+        with ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            for name, rows in zip(changed, executor.map(read_bank, paths)):
+                with connection:
+                    connection.execute("DELETE FROM pitch WHERE bank = ?", (name,))
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO pitch VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                    connection.execute(
+                        "INSERT OR REPLACE INTO banks VALUES (?, ?)",
+                        (name, checksums[name]),
+                    )
+
+        connection.execute(f"PRAGMA user_version = {PITCH_INDEX_VERSION}")
+        connection.close()
+
+        print(
+            f"Pitch index: {len(changed)} banks indexed, {len(removed)} removed, "
+            f"{len(checksums) - len(changed)} unchanged."
+        )
+        return cls(path)
+
+
+def file_checksum(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def read_bank(path: str) -> list[tuple]:
+    """Reads the index rows of every pitch variant of a term bank."""
+    with open(path, "r") as file:
+        bank = json.load(file)
+
+    name = os.path.basename(path)
+    rows = []
+    for expression, _, data in bank:
+        reading = data["reading"]
+        mora = hira_to_mora(reading)
+        for variant, pitch in enumerate(data["pitches"]):
+            position = pitch["position"]
+            pattern = pitch_position_to_pattern(mora, position)
+            rows.append(
+                (expression, reading, name, variant, position, " ".join(mora), pattern)
+            )
+    return rows
+
+
+@functools.lru_cache(maxsize=None)
+def _open_pitch_index(path: str) -> PitchIndex:
+    path = pathlib.Path(path)
+    if path.exists():
+        index = PitchIndex(path)
+        if index.version == PITCH_INDEX_VERSION:
+            return index
+        index.close()
+
+    print("Creating pitch index...")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return PitchIndex.build(path)
+
+
+def build_pitch_index(
+    *, alt_path: str | None = None, processes: int | None = None
+) -> PitchIndex:
+    """Builds or updates the pitch index after term banks were changed."""
+    path = pathlib.Path(alt_path if alt_path else PITCH_INDEX_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _open_pitch_index.cache_clear()
+    return PitchIndex.build(path, processes=processes)
+
+
+def load_pitch_dictionary(*, alt_path: str | None = None) -> PitchIndex:
     """Loads a pitch dictionary.
+
+    The index is built from the term banks on first use, then shared by all
+    callers.
+
     Args:
-        alt_path: An alternative path to a pitch dictionary.
+        alt_path: An alternative path to a pitch index.
     Returns:
         The pitch dictionary.
 
@@ -181,61 +382,57 @@ def load_pitch_dictionary(*, alt_path: str | None = None) -> dict:
     }
     ```
     """
-    path = pathlib.Path(alt_path if alt_path else PITCH_DICTIONARY_PATH)
-    path.parent.mkdir(parents=True, exist_ok=True)
-
-    if path.exists():
-        with path.open("r") as file:
-            return json.load(file)
-
-    print("Creating pitch dictionary...")
-
-    pitch_dictionary = {}
-    for bank_file in os.listdir(PITCH_DATA_DIRECTORY):
-        if "term_meta_bank" in bank_file:
-            with open(os.path.join(PITCH_DATA_DIRECTORY, bank_file), "r") as file:
-                bank = json.load(file)
+    return _open_pitch_index(alt_path if alt_path else PITCH_INDEX_PATH)
 
-        for expression, _, pitch_data in bank:
-            spelling = pitch_data["reading"]
-            position = pitch_data["pitches"][0]["position"]
 
-            if expression in pitch_dictionary:
-                pitch_dictionary[expression][spelling] = position
-            else:
-                pitch_dictionary[expression] = {spelling: position}
-
-    with path.open("w") as file:
-        json.dump(pitch_dictionary, file)
+def get_pitch_position(
+    pitch_dictionary: PitchIndex | dict, expression: str, spelling: str
+) -> int:
+    return pitch_dictionary[expression][spelling]
 
-    return pitch_dictionary
 
+def get_mora_and_pattern(
+    pitch_dictionary: PitchIndex | dict, expression: str, spelling: str
+) -> tuple[list[str], str]:
+    """Gets the moras and the pitch pattern of a spelling, precomputed when
+    the dictionary is an index."""
+    if isinstance(pitch_dictionary, PitchIndex):
+        return pitch_dictionary.get_mora_and_pattern(expression, spelling)
 
-def get_pitch_position(pitch_dictionary: dict, expression: str, spelling: str) -> int:
-    return pitch_dictionary[expression][spelling]
+    position = get_pitch_position(pitch_dictionary, expression, spelling)
+    mora = hira_to_mora(spelling)
+    pattern = pitch_position_to_pattern(mora, position)
+    if pattern is None:
+        raise KeyError((expression, spelling))
+    return mora, pattern
 
 
 class Pitch:
     __slots__ = ["expression", "spelling", "mora", "html"]
 
     @classmethod
+    @metrics.timed("field.pitch")
     def from_expression_and_reading(
-        cls, expression: str, reading: str, *, pitch_dictionary: dict | None = None
+        cls,
+        expression: str,
+        reading: str,
+        *,
+        pitch_dictionary: PitchIndex | dict | None = None,
     ):
         """Creates an instance of Pitch given an expression and reading"""
         pitch = Pitch()
         pitch.expression = expression
         pitch.spelling = reading
-        pitch.mora = hira_to_mora(reading)
 
         pitch_dictionary = (
             pitch_dictionary if pitch_dictionary else load_pitch_dictionary()
         )
         try:
-            pitch_position = get_pitch_position(pitch_dictionary, expression, reading)
+            pitch.mora, pitch_pattern = get_mora_and_pattern(
+                pitch_dictionary, expression, reading
+            )
         except KeyError:
             return None
 
-        pitch_pattern = pitch_position_to_pattern(pitch.mora, pitch_position)
         pitch.html = pitch_svg(reading, pitch_pattern)
         return pitch
@@ -1,10 +1,18 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
+
+from jpdb_anki import metrics
 
 
 def get_spelling(jpdb: BeautifulSoup) -> str:
     """Extracts spelling from JPDB page."""
+    return spelling_from_section(jpdb.find(class_="primary-spelling"))
+
+
+@metrics.timed("field.spelling")
+def spelling_from_section(primary_spelling: Tag) -> str:
+    """Extracts spelling from the primary spelling section of a JPDB page."""
     spelling = ""
-    contents = jpdb.find(class_="primary-spelling").find("ruby").contents
+    contents = primary_spelling.find("ruby").contents
     for s in contents:
         s = str(s)
         if "<rt>" in s:
@@ -0,0 +1,119 @@
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+from typing import Iterable, Iterator
+
+from jpdb_anki.parallel import batched
+from jpdb_anki.scraping import DEFAULT_PAGE_WORKERS, VocabPage, iter_vocab_pages
+from jpdb_anki.store import MAX_QUERY_PARAMETERS
+
+JOBS_DIRECTORY = os.path.join("data", "jobs")
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """A journal of a scraping job, to resume it after an interruption.
+
+    The journal records each fetched page of the vocabulary list, and the
+    fetch status of each vocabulary entry: pending, done, or failed with
+    its error. Records are committed as soon as they are made.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS pages (position INTEGER PRIMARY KEY, "
+                "url TEXT UNIQUE NOT NULL, entries TEXT NOT NULL, next_url TEXT)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, "
+                "status TEXT NOT NULL, error TEXT)"
+            )
+
+    def reset(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM pages")
+            self._connection.execute("DELETE FROM entries")
+
+    def pages(self) -> dict[str, VocabPage]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT url, entries, next_url FROM pages"
+            ).fetchall()
+        return {
+            url: VocabPage(url, json.loads(entries), next_url)
+            for url, entries, next_url in rows
+        }
+
+    def record_page(self, page: VocabPage) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO pages (url, entries, next_url) VALUES (?, ?, ?)",
+                (page.url, json.dumps(page.entries), page.next_url),
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO entries (url, status) VALUES (?, ?)",
+                [(url, PENDING) for url in page.entries],
+            )
+
+    def iter_entries(
+        self, root_url: str, *, workers: int = DEFAULT_PAGE_WORKERS
+    ) -> Iterator[str]:
+        """Yields the entries of the list, only fetching unrecorded pages."""
+        known = self.pages()
+        for page in iter_vocab_pages(root_url, workers=workers, known=known):
+            if page.url not in known:
+                self.record_page(page)
+            yield from page.entries
+
+    def done(self, urls: Iterable[str]) -> set[str]:
+        """Selects the entries whose note was already fetched by this job."""
+        done = set()
+        with self._lock:
+            for batch in batched(urls, MAX_QUERY_PARAMETERS):
+                done.update(
+                    url
+                    for url, in self._connection.execute(
+                        "SELECT url FROM entries WHERE status = ? AND url IN (%s)"
+                        % ",".join("?" * len(batch)),
+                        [DONE, *batch],
+                    )
+                )
+        return done
+
+    def record_results(self, done: Iterable[str], failed: dict[str, str]) -> None:
+        """Records fetched entries, and failed entries with their error."""
+        rows = [(url, DONE, None) for url in done]
+        rows += [(url, FAILED, error) for url, error in failed.items()]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entries (url, status, error) VALUES (?, ?, ?)",
+                rows,
+            )
+
+    def failed(self) -> list[tuple[str, str]]:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT url, error FROM entries WHERE status = ?", (FAILED,)
+            ).fetchall()
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(
+                self._connection.execute(
+                    "SELECT status, COUNT(*) FROM entries GROUP BY status"
+                ).fetchall()
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
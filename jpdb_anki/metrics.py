@@ -0,0 +1,165 @@
+"""Opt-in timers and counters of the stages of the pipeline.
+
+Instrumented functions are decorated with `timed`, or run blocks in a
+`timer`, and events are counted with `count`. Nothing is recorded until
+`enable` is called, so the instrumentation costs a single check when it
+is disabled.
+
+Times are summed over all the calls, also when calls run concurrently in
+several threads, so the total time of a stage can exceed the wall time.
+
+Example:
+    metrics.enable(output="metrics.json")
+    ...
+    # a summary is printed at exit, and the metrics written to metrics.json
+"""
+
+import atexit
+import functools
+import json
+import pathlib
+import threading
+import time
+from typing import Callable
+
+PROMETHEUS_PREFIX = "jpdb_anki"
+
+enabled = False
+
+
+class Metrics:
+    """The timings of each stage and the counts of each event."""
+
+    def __init__(self) -> None:
+        self.timings: dict[str, list[float]] = {}  # {stage: [calls, total, max]}
+        self.counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def reset(self) -> None:
+        with self._lock:
+            self.timings.clear()
+            self.counts.clear()
+
+    def summary(self) -> str:
+        lines = [
+            f"{'stage':<24} {'calls':>8} {'total s':>9} {'mean ms':>9} {'max ms':>9}"
+        ]
+        for name, (calls, total, max_) in sorted(self.timings.items()):
+            lines.append(
+                f"{name:<24} {calls:>8} {total:>9.2f} "
+                f"{total / calls * 1000:>9.2f} {max_ * 1000:>9.2f}"
+            )
+        for name, n in sorted(self.counts.items()):
+            lines.append(f"{name:<24} {n:>8}")
+        return "\n".join(lines)
+
+    def to_json(self) -> dict:
+        return {
+            "timings": {
+                name: {"calls": calls, "total_seconds": total, "max_seconds": max_}
+                for name, (calls, total, max_) in self.timings.items()
+            },
+            "counts": dict(self.counts),
+        }
+
+    def to_prometheus(self) -> str:
+        """Formats the metrics in the Prometheus text exposition format."""
+        stage = PROMETHEUS_PREFIX + "_stage_seconds"
+        event = PROMETHEUS_PREFIX + "_events_total"
+        lines = [f"# TYPE {stage} summary"]
+        for name, (calls, total, _) in sorted(self.timings.items()):
+            lines.append(f'{stage}_count{{stage="{name}"}} {calls}')
+            lines.append(f'{stage}_sum{{stage="{name}"}} {total}')
+        lines.append(f"# TYPE {event} counter")
+        for name, n in sorted(self.counts.items()):
+            lines.append(f'{event}{{event="{name}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: pathlib.Path) -> None:
+        """Writes the metrics as Prometheus text for a `.prom` file, else JSON."""
+        with path.open("w") as file:
+            if path.suffix == ".prom":
+                file.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), file, indent=2)
+
+
+registry = Metrics()
+
+
+def enable(*, output: str | None = None, report: bool = True) -> None:
+    """Starts recording metrics.
+
+    Args:
+        output: An optional path where the metrics are written at exit.
+        report: If True, a summary is printed at exit.
+    """
+    global enabled
+    enabled = True
+
+    def at_exit() -> None:
+        if report:
+            print(registry.summary())
+        if output:
+            registry.dump(pathlib.Path(output))
+
+    atexit.register(at_exit)
+
+
+def count(name: str, n: int = 1) -> None:
+    if enabled:
+        registry.count(name, n)
+
+
+class timer:
+    """Times a block of code as a stage.
+
+    Example:
+        with metrics.timer("load_url.fetch"):
+            content = get_cache().get(url)
+    """
+
+    __slots__ = ["name", "start"]
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.start is not None:
+            registry.record(self.name, time.perf_counter() - self.start)
+
+
+def timed(name: str) -> Callable:
+    """Decorates a function to time each of its calls as a stage."""
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                registry.record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
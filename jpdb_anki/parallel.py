@@ -0,0 +1,45 @@
+import collections
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+DEFAULT_WORKERS = 8
+
+
+def ordered_map(
+    fn: Callable, iterable: Iterable, *, workers: int, window: int | None = None
+) -> Iterator:
+    """Applies a function to each item of an iterable with a pool of threads.
+
+    Results are yielded in the order of the iterable as soon as they are
+    available. Items are consumed lazily so that the iterable can itself be
+    a stream. The function runs in a copy of the context of the caller, for
+    instance with its request priority.
+
+    Args:
+        fn: A function to apply to each item.
+        iterable: An iterable of items.
+        workers: The number of threads.
+        window: The maximum number of pending items. Defaults to 4 * workers.
+    """
+    window = window if window else 4 * workers
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(executor.submit(contextvars.copy_context().run, fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """Splits an iterable into lists of at most `size` items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -1,15 +1,56 @@
+import functools
+import json
+import pathlib
+import threading
+from typing import Iterable, Iterator, NamedTuple
+import urllib.parse
+
 from bs4 import BeautifulSoup
-import requests
-import spacy
 from tqdm import tqdm
 
+from jpdb_anki import metrics
+from jpdb_anki.cache import get_cache
+from jpdb_anki.parallel import ordered_map
+
+DEFAULT_PAGE_WORKERS = 4
+DEFAULT_SEARCH_WORKERS = 8
+
+NLP_MODEL = "ja_ginza"
+UNUSED_PIPES = ("parser", "ner", "bunsetu_recognizer", "compound_splitter")
+DEFAULT_NLP_BATCH_SIZE = 16
+MAX_CHUNK_CHARS = 10000  # Sudachi rejects inputs over 49149 bytes
+
+# Universal POS tags of punctuation, particles, numerals, auxiliaries, etc.
+SKIPPED_POS = {"ADP", "AUX", "CCONJ", "NUM", "PART", "PUNCT", "SCONJ", "SPACE", "SYM"}
+
+
+def default_html_parser() -> str:
+    """Selects lxml when it is installed, html.parser otherwise."""
+    try:
+        import lxml  # noqa: F401
+    except ImportError:
+        return "html.parser"
+    return "lxml"
+
+
+html_parser = default_html_parser()
 
+
+def parse_html(content: bytes) -> BeautifulSoup:
+    return BeautifulSoup(content, html_parser)
+
+
+@metrics.timed("load_url")
 def load_url(url: str) -> BeautifulSoup:
-    return BeautifulSoup(requests.get(url).content, "html.parser")
+    with metrics.timer("load_url.fetch"):
+        content = get_cache().get(url)
+    with metrics.timer("load_url.parse"):
+        return parse_html(content)
 
 
 def get_base_url(url: str) -> str:
-    return "https://" + url.split("/")[2]
+    parsed = urllib.parse.urlparse(url)
+    return (parsed.scheme or "https") + "://" + parsed.netloc
 
 
 def get_vocab_entries_from_one_page(jpdb: BeautifulSoup) -> list[str]:
@@ -17,25 +58,106 @@ def get_vocab_entries_from_one_page(jpdb: BeautifulSoup) -> list[str]:
     return [s.find("a", href=True)["href"] for s in vocab_entries]
 
 
-def get_all_vocab_entries(root_url: str) -> list[str]:
+def get_next_page(jpdb: BeautifulSoup, base_url: str) -> str | None:
+    """Finds the url of the next page of a vocabulary list, if any."""
+    if jpdb.find(class_="pagination without-next"):
+        return None
+
+    pagination = jpdb.find(class_="pagination")
+    if pagination is None:
+        return None
+    return base_url + pagination.find_all("a", href=True)[-1]["href"][:-2]
+
+
+def with_offset(url: str, offset: int) -> str:
+    parsed = urllib.parse.urlparse(url)
+    query = urllib.parse.parse_qs(parsed.query)
+    query["offset"] = [str(offset)]
+    return parsed._replace(query=urllib.parse.urlencode(query, doseq=True)).geturl()
+
+
+class VocabPage(NamedTuple):
+    url: str
+    entries: list[str]
+    next_url: str | None
+
+
+def iter_vocab_pages(
+    root_url: str,
+    *,
+    workers: int = DEFAULT_PAGE_WORKERS,
+    known: dict[str, VocabPage] | None = None,
+) -> Iterator[VocabPage]:
+    """Yields each page of a vocabulary list.
+
+    The offset scheme of the list is read from the link to the second page,
+    then the next pages are fetched concurrently by windows of pages, until
+    a page has no next page. Windows start with one page and double up to
+    `workers` pages, so that short lists cost few requests past their last
+    page. Pages past the last page are not kept in the cache. Pages are
+    yielded in order. If the scheme is unknown, next links are followed one
+    page at a time.
+
+    Args:
+        root_url: The url of the vocabulary list.
+        workers: The number of pages fetched concurrently.
+        known: Pages already fetched by url, that are not fetched again.
+    """
     base_url = get_base_url(root_url)
+    known = known if known is not None else {}
 
-    jpdb = load_url(root_url)
-    vocab_entries = get_vocab_entries_from_one_page(jpdb)
-    vocab_entries = [base_url + e.strip("#a") for e in vocab_entries]
+    def read_page(url: str) -> VocabPage:
+        if url in known:
+            return known[url]
+        jpdb = load_url(url)
+        vocab_entries = get_vocab_entries_from_one_page(jpdb)
+        vocab_entries = [base_url + e.strip("#a") for e in vocab_entries]
+        return VocabPage(url, vocab_entries, get_next_page(jpdb, base_url))
 
-    if jpdb.find(class_="pagination without-next"):
-        return vocab_entries
+    page = read_page(root_url)
+    yield page
+    if page.next_url is None:
+        return
 
-    without_prev = jpdb.find(class_="pagination without-prev")
-    if without_prev:
-        next_root = without_prev.find_all("a", href=True)[-1]["href"][:-2]
-        vocab_entries += get_all_vocab_entries(base_url + next_root)
-        return vocab_entries
+    next_url = page.next_url
+    offset = urllib.parse.parse_qs(urllib.parse.urlparse(next_url).query).get("offset")
+    if not offset:
+        while next_url is not None:
+            page = read_page(next_url)
+            yield page
+            next_url = page.next_url
+        return
 
-    next_root = jpdb.find(class_="pagination").find_all("a", href=True)[-1]["href"][:-2]
-    vocab_entries += get_all_vocab_entries(base_url + next_root)
-    return vocab_entries
+    step = int(offset[0])
+    position, size = 1, 1
+    while True:
+        page_urls = [
+            with_offset(next_url, step * n) for n in range(position, position + size)
+        ]
+        pages = list(ordered_map(read_page, page_urls, workers=workers))
+        for i, page in enumerate(pages):
+            if page.entries:
+                yield page
+            if page.next_url is None or not page.entries:
+                past_end = i + 1 if page.entries else i
+                for empty_page in pages[past_end:]:
+                    get_cache().discard(empty_page.url)
+                return
+        position, size = position + size, min(workers, 2 * size)
+
+
+def iter_vocab_entries(
+    root_url: str, *, workers: int = DEFAULT_PAGE_WORKERS
+) -> Iterator[str]:
+    """Yields the vocabulary entries of a list as its pages are fetched."""
+    for page in iter_vocab_pages(root_url, workers=workers):
+        yield from page.entries
+
+
+def get_all_vocab_entries(
+    root_url: str, *, workers: int = DEFAULT_PAGE_WORKERS
+) -> list[str]:
+    return list(iter_vocab_entries(root_url, workers=workers))
 
 
 def get_vocab_entry_from_search(expression: str) -> str:
@@ -54,20 +176,200 @@ def get_vocab_entry_from_search(expression: str) -> str:
     return get_base_url(search_url) + entry.strip("#a")
 
 
-def get_vocab_entries_from_text(text: str) -> list[str]:
-    tokenized = spacy.load("ja_ginza")(text)
-    seen_tokens = set()
-    vocab_entries = []
+class SearchCache:
+    """A persistent cache of search results.
+
+    Maps expressions to the url of their vocabulary entry, or to None when
+    the search has no result. The cache is only kept in memory if no path is
+    given.
+    """
+
+    def __init__(self, path: pathlib.Path | None = None) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: dict[str, str | None] = {}
+        self.unsaved = 0
+        if path is not None and path.exists():
+            with path.open("r") as file:
+                self._entries = json.load(file)
+
+    def __contains__(self, expression: str) -> bool:
+        return expression in self._entries
 
-    for i, sent in enumerate(tokenized.sents):
-        for token in tqdm(sent, f"Searching expressions for sentence {i}."):
-            if token.norm_ in seen_tokens:
-                continue
-            seen_tokens.add(token.norm_)
+    def __getitem__(self, expression: str) -> str | None:
+        return self._entries[expression]
 
-            try:
-                vocab_entries.append(get_vocab_entry_from_search(token.norm_))
-            except AttributeError:
-                continue
+    def __setitem__(self, expression: str, entry: str | None) -> None:
+        with self._lock:
+            self._entries[expression] = entry
+            self.unsaved += 1
 
-    return vocab_entries
+    def save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, self.path.open("w") as file:
+            json.dump(self._entries, file, ensure_ascii=False)
+            self.unsaved = 0
+
+
+def search_vocab_entry(expression: str) -> str | None:
+    """Searches the vocabulary entry of an expression, None if not found."""
+    try:
+        return get_vocab_entry_from_search(expression)
+    except AttributeError:
+        return None
+
+
+def search_vocab_entry_or_error(expression: str) -> str | None | Exception:
+    try:
+        return search_vocab_entry(expression)
+    except Exception as e:
+        return e
+
+
+def resolve_expressions(
+    expressions: Iterable[str],
+    *,
+    cache: SearchCache | None = None,
+    workers: int = DEFAULT_SEARCH_WORKERS,
+    errors: dict[str, str] | None = None,
+    save: bool = True,
+) -> dict[str, str | None]:
+    """Resolves expressions to vocabulary entries.
+
+    Each unique expression is searched once. Expressions missing from the
+    cache are searched concurrently, and the results, including
+    expressions without any result, are saved in the cache, also when a
+    search raises.
+
+    Args:
+        expressions: An iterable of expressions.
+        cache: An optional cache of search results.
+        workers: The number of concurrent searches.
+        errors: If given, the searches that raise are recorded in this
+            dictionary with their error instead of raising. They are left out
+            of the cache and of the result.
+        save: Whether the cache is saved once the searches are done. Callers
+            resolving many small batches save it themselves instead.
+    Returns:
+        A dictionary mapping each expression to its vocabulary entry, or to
+        None when the search has no result.
+    """
+    cache = cache if cache is not None else SearchCache()
+    expressions = list(dict.fromkeys(expressions))
+
+    missing = [e for e in expressions if e not in cache]
+    entries = ordered_map(
+        search_vocab_entry if errors is None else search_vocab_entry_or_error,
+        missing,
+        workers=workers,
+    )
+    try:
+        for expression, entry in zip(
+            missing, tqdm(entries, "Searching expressions.", total=len(missing))
+        ):
+            if isinstance(entry, Exception):
+                errors[expression] = repr(entry)
+            else:
+                cache[expression] = entry
+    finally:
+        # Results are kept even if a search fails or the run is interrupted
+        if missing and save:
+            cache.save()
+
+    return {e: cache[e] for e in expressions if e in cache}
+
+
+def is_searchable(token) -> bool:
+    """Filters out tokens that have no vocabulary entry worth a note."""
+    return (
+        token.pos_ not in SKIPPED_POS
+        and not token.is_punct
+        and not token.like_num
+        and bool(token.norm_.strip())
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def load_nlp():
+    """Loads the GiNZA pipeline once per process, without unused components.
+
+    spaCy is imported here, as it takes seconds and only the parse task uses it.
+    """
+    import spacy
+
+    return spacy.load(NLP_MODEL, exclude=list(UNUSED_PIPES))
+
+
+def iter_text_chunks(
+    lines: Iterable[str], *, max_chars: int = MAX_CHUNK_CHARS
+) -> Iterator[str]:
+    """Groups the paragraphs of a text into chunks of at most `max_chars`."""
+    chunk, size = [], 0
+    for line in lines:
+        line = line.strip()
+        if size + len(line) > max_chars and chunk:
+            yield "\n".join(chunk)
+            chunk, size = [], 0
+        while len(line) > max_chars:
+            yield line[:max_chars]
+            line = line[max_chars:]
+        if line:
+            chunk.append(line)
+            size += len(line) + 1
+    if chunk:
+        yield "\n".join(chunk)
+
+
+def iter_expressions_from_text(
+    lines: Iterable[str],
+    *,
+    batch_size: int = DEFAULT_NLP_BATCH_SIZE,
+    n_process: int = 1,
+) -> Iterator[str]:
+    """Yields the searchable expressions of a text.
+
+    The text is split into chunks of paragraphs that are tokenized in
+    batches, so memory does not grow with the length of the text.
+
+    Args:
+        lines: An iterable of the lines of the text, such as a file.
+        batch_size: The number of chunks tokenized at once.
+        n_process: The number of tokenizing processes.
+    """
+    chunks = iter_text_chunks(lines)
+    for doc in load_nlp().pipe(chunks, batch_size=batch_size, n_process=n_process):
+        for token in doc:
+            if is_searchable(token):
+                yield token.norm_
+
+
+def get_vocab_entries_from_text(
+    text: str | Iterable[str],
+    *,
+    cache: SearchCache | None = None,
+    workers: int = DEFAULT_SEARCH_WORKERS,
+    n_process: int = 1,
+    errors: dict[str, str] | None = None,
+) -> list[str]:
+    """Finds the vocabulary entries of the expressions of a text.
+
+    Expressions whose search fails are skipped, so that one failed search
+    does not stop the parse of a whole text.
+
+    Args:
+        text: A text, or an iterable of its lines such as a file.
+        cache: An optional cache of search results.
+        workers: The number of concurrent searches.
+        n_process: The number of tokenizing processes.
+        errors: An optional dictionary where the expressions whose search
+            failed are recorded with their error.
+    """
+    errors = errors if errors is not None else {}
+    lines = text.splitlines() if isinstance(text, str) else text
+    expressions = iter_expressions_from_text(lines, n_process=n_process)
+    entries = resolve_expressions(
+        expressions, cache=cache, workers=workers, errors=errors
+    )
+    return list(dict.fromkeys(e for e in entries.values() if e is not None))
@@ -0,0 +1,224 @@
+"""A local HTTP server keeping the database, caches and models loaded.
+
+Started with `python -m jpdb_anki -t serve`, it answers JSON requests:
+
+- GET /search?q=$expression
+    The note of the vocabulary entry of an expression.
+- GET /note?url=$vocabulary-entry-url
+    The note of a vocabulary entry.
+- POST /parse, with a text as body
+    The vocabulary entries of the words of the text, and the errors of the
+    searches that failed.
+- POST /export, with `{"entries": [...], "expressions": [...], "name": ...}`
+    An APKG file with the notes of vocabulary entries and expressions.
+- GET /health
+    The number of saved notes.
+
+Requests are handled concurrently, each in its own thread. The requests to
+JPDB of /search and /note are sent before those of /parse and /export. New
+search results are saved every `SEARCH_CACHE_SAVE_INTERVAL` seconds, and when
+the server stops.
+"""
+
+import http.server
+import json
+import pathlib
+import tempfile
+import threading
+import urllib.parse
+
+from jpdb_anki import session
+from jpdb_anki.database import Database
+from jpdb_anki.fields import note
+from jpdb_anki.scraping import (
+    iter_expressions_from_text,
+    load_nlp,
+    resolve_expressions,
+)
+
+MAX_BODY_BYTES = 16 << 20
+SEARCH_CACHE_SAVE_INTERVAL = 30
+
+
+class RequestError(Exception):
+    """An error answered to the client with an HTTP status code."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def note_to_json(note_: note.Note) -> dict:
+    return {
+        "url": note_.url,
+        "expression": note_.expression,
+        "reading": note_.reading,
+        "frequency": note_.frequency,
+        "spelling": note_.spelling,
+        "part_of_speech": getattr(note_, "part_of_speech", ""),
+        "meanings": note_.meanings,
+        "pitch": note_.pitch.html if note_.pitch else None,
+        "examples": note_.examples,
+    }
+
+
+def warm_up(db: Database) -> None:
+    """Loads the pitch dictionary, the NLP pipeline and the HTTP session."""
+    db.pitch_dictionary
+    session.get_session()
+    try:
+        load_nlp()
+    except (ImportError, OSError) as e:
+        print("The NLP pipeline could not be loaded, /parse is unavailable:", e)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Answers the requests of the server with its database."""
+
+    server: "Server"
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        routes = {"/search": self.search, "/note": self.note, "/health": self.health}
+        self.answer(routes, url.path, query)
+
+    def do_POST(self) -> None:
+        routes = {"/parse": self.parse, "/export": self.export}
+        self.answer(routes, urllib.parse.urlparse(self.path).path)
+
+    def answer(self, routes: dict, path: str, *args) -> None:
+        try:
+            if path not in routes:
+                raise RequestError(404, f"Unknown endpoint {path}")
+            routes[path](*args)
+        except RequestError as e:
+            self.send_json({"error": str(e)}, status=e.status)
+        except Exception as e:
+            self.send_json({"error": repr(e)}, status=500)
+
+    def send_json(self, obj, *, status: int = 200) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_BODY_BYTES:
+            raise RequestError(413, "Request body too large")
+        return self.rfile.read(length)
+
+    def read_json(self) -> dict:
+        try:
+            return json.loads(self.read_body())
+        except ValueError as e:
+            raise RequestError(400, f"Invalid JSON body: {e}")
+
+    def search(self, query: dict) -> None:
+        if "q" not in query:
+            raise RequestError(400, "Missing parameter q")
+        expression = query["q"][0]
+        db = self.server.db
+        with session.priority(session.INTERACTIVE):
+            entry = resolve_expressions([expression], cache=db.search_cache, save=False)
+            if entry[expression] is None:
+                raise RequestError(404, f"No vocabulary entry for {expression}")
+            note_ = db.get_note(entry[expression])
+        self.send_json(note_to_json(note_))
+
+    def note(self, query: dict) -> None:
+        if "url" not in query:
+            raise RequestError(400, "Missing parameter url")
+        with session.priority(session.INTERACTIVE):
+            note_ = self.server.db.get_note(query["url"][0])
+        self.send_json(note_to_json(note_))
+
+    def health(self, _) -> None:
+        self.send_json({"notes": len(self.server.db.notes)})
+
+    def parse(self) -> None:
+        text = self.read_body().decode("utf-8")
+        db = self.server.db
+        # spaCy pipelines are not thread-safe, the searches are sent unlocked
+        with self.server.nlp_lock:
+            expressions = list(iter_expressions_from_text(text.splitlines()))
+        errors = {}
+        resolved = resolve_expressions(
+            expressions,
+            cache=db.search_cache,
+            workers=db.workers,
+            errors=errors,
+            save=False,
+        )
+        entries = list(dict.fromkeys(e for e in resolved.values() if e is not None))
+        self.send_json({"entries": entries, "errors": errors})
+
+    def export(self) -> None:
+        request = self.read_json()
+        db = self.server.db
+        entries = list(request.get("entries", []))
+        expressions = request.get("expressions", [])
+        if expressions:
+            resolved = resolve_expressions(
+                expressions, cache=db.search_cache, save=False
+            )
+            entries += [e for e in resolved.values() if e is not None]
+        if not entries:
+            raise RequestError(400, "No entries or expressions to export")
+
+        name = pathlib.Path(str(request.get("name", "output"))).name
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = pathlib.Path(directory, name + ".apkg")
+            db.write_apkg_from_list(str(filepath), entries)
+            if not filepath.exists():
+                raise RequestError(404, "No new or changed notes to export")
+            package = filepath.read_bytes()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header(
+            "Content-Disposition", f'attachment; filename="{filepath.name}"'
+        )
+        self.send_header("Content-Length", str(len(package)))
+        self.end_headers()
+        self.wfile.write(package)
+
+
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], db: Database) -> None:
+        super().__init__(address, Handler)
+        self.db = db
+        self.nlp_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def save_search_cache(self, interval: float) -> None:
+        """Saves the new search results every `interval` seconds until stopped."""
+        while not self.stopped.wait(interval):
+            if self.db.search_cache.unsaved:
+                self.db.search_cache.save()
+
+
+def serve(db: Database, *, host: str, port: int) -> None:
+    """Serves the database until interrupted."""
+    warm_up(db)
+    with Server((host, port), db) as server:
+        saver = threading.Thread(
+            target=server.save_search_cache,
+            args=(SEARCH_CACHE_SAVE_INTERVAL,),
+            daemon=True,
+        )
+        saver.start()
+        print(f"Serving on http://{host}:{server.server_address[1]}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stopped.set()
+            saver.join()
+    db.search_cache.save()
@@ -0,0 +1,321 @@
+import contextlib
+import contextvars
+import email.utils
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 1.0
+DEFAULT_REQUESTS_PER_SECOND = 5.0
+DEFAULT_BURST = 1
+MAX_BACKOFF = 120.0
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+THROTTLE_STATUS_CODES = (429, 503)
+
+# A throttled host gets its rate divided by up to MAX_SLOWDOWN, then restored
+# progressively with each request that is not throttled.
+SLOWDOWN_FACTOR = 2.0
+RECOVERY_FACTOR = 0.9
+MAX_SLOWDOWN = 16.0
+MIN_WAIT = 0.001
+
+# Priority lanes of the scheduler, lower lanes are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_lane = contextvars.ContextVar("lane", default=BACKGROUND)
+
+
+@contextlib.contextmanager
+def priority(lane: int) -> Iterator[None]:
+    """Sends the requests of the current context in a priority lane.
+
+    Example:
+        with session.priority(session.INTERACTIVE):
+            note = db.get_note(url)
+    """
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class _Bucket:
+    """The token bucket and the waiting requests of a host."""
+
+    __slots__ = ["tokens", "updated_at", "slowdown", "blocked_until", "waiting"]
+
+    def __init__(self, tokens: float, now: float) -> None:
+        self.tokens = tokens
+        self.updated_at = now
+        self.slowdown = 1.0
+        self.blocked_until = now
+        self.waiting: list[tuple[int, int]] = []  # heap of (lane, ticket)
+
+
+class Scheduler:
+    """Paces the requests sent to a same host with a token bucket.
+
+    Each host has a bucket of `burst` tokens refilled at `requests_per_second`,
+    and each request takes a token. Waiting requests are served by priority
+    lane, see `priority`, then in arrival order, so interactive requests are
+    not starved by a background scrape.
+
+    When the host throttles a request, `penalize` pauses the host and divides
+    its rate, and `reward` restores it progressively.
+
+    Attributes:
+        requests_per_second: The maximum number of requests per second sent
+            to each host. No limit is applied if None.
+        burst: The number of requests that can be sent at once after the
+            host was idle.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float | None = None,
+        *,
+        burst: int = DEFAULT_BURST,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets: dict[str, _Bucket] = {}
+        self._tickets = itertools.count()
+        self._lock = threading.Lock()
+
+    def _bucket(self, url: str) -> _Bucket:
+        host = url.split("/")[2]
+        if host not in self._buckets:
+            self._buckets[host] = _Bucket(self.burst, self._clock())
+        return self._buckets[host]
+
+    def _refill(self, bucket: _Bucket, now: float) -> float:
+        """Adds the tokens earned since the last refill, and returns the rate."""
+        rate = self.requests_per_second / bucket.slowdown
+        if now > bucket.updated_at:
+            elapsed = now - bucket.updated_at
+            bucket.tokens = min(self.burst, bucket.tokens + elapsed * rate)
+            bucket.updated_at = now
+        return rate
+
+    def wait(self, url: str, *, lane: int | None = None) -> None:
+        """Blocks until a request to the host of the url is allowed.
+
+        Args:
+            url: The url of the request.
+            lane: The priority lane of the request. Defaults to the lane of
+                the current context.
+        """
+        if not self.requests_per_second:
+            with self._lock:
+                delay = self._bucket(url).blocked_until - self._clock()
+            if delay > 0:
+                self._sleep(delay)
+            return
+
+        with self._lock:
+            bucket = self._bucket(url)
+            ticket = (_lane.get() if lane is None else lane, next(self._tickets))
+            heapq.heappush(bucket.waiting, ticket)
+
+        try:
+            while True:
+                with self._lock:
+                    now = self._clock()
+                    rate = self._refill(bucket, now)
+                    ahead = sum(waiting < ticket for waiting in bucket.waiting)
+                    if not ahead and bucket.tokens >= 1 and now >= bucket.blocked_until:
+                        bucket.tokens -= 1
+                        return
+                    # Sleeps until the requests ahead could have been sent
+                    delay = max(
+                        bucket.blocked_until - now,
+                        (ahead + 1 - bucket.tokens) / rate,
+                        MIN_WAIT,
+                    )
+                self._sleep(delay)
+        finally:
+            with self._lock:
+                bucket.waiting.remove(ticket)
+                heapq.heapify(bucket.waiting)
+
+    def penalize(self, url: str, delay: float = 0.0) -> None:
+        """Pauses the host for `delay` seconds and slows it down."""
+        with self._lock:
+            bucket = self._bucket(url)
+            now = self._clock()
+            # Tokens are earned again once the pause is over
+            bucket.tokens = 0.0
+            bucket.blocked_until = max(bucket.blocked_until, now + delay)
+            bucket.updated_at = bucket.blocked_until
+            bucket.slowdown = min(MAX_SLOWDOWN, bucket.slowdown * SLOWDOWN_FACTOR)
+
+    def reward(self, url: str) -> None:
+        """Restores progressively the rate of a host that was slowed down."""
+        with self._lock:
+            bucket = self._bucket(url)
+            if bucket.slowdown > 1.0:
+                if self.requests_per_second:
+                    self._refill(bucket, self._clock())
+                bucket.slowdown = max(1.0, bucket.slowdown * RECOVERY_FACTOR)
+
+    def slowdown(self, url: str) -> float:
+        """The factor dividing the rate of the host of the url."""
+        with self._lock:
+            return self._bucket(url).slowdown
+
+
+class SessionStats:
+    """Counts the requests sent by a session."""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.bytes = 0
+        self.retries = 0
+        self.errors = 0
+        self.latency = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, *, n_bytes: int = 0, latency: float = 0.0) -> None:
+        with self._lock:
+            self.requests += 1
+            self.bytes += n_bytes
+            self.latency += latency
+
+    def record_retry(self, *, error: bool = False) -> None:
+        with self._lock:
+            self.retries += 1
+            self.errors += int(error)
+
+    def __str__(self) -> str:
+        mean_latency = self.latency / self.requests if self.requests else 0.0
+        return (
+            f"{self.requests} requests, {self.bytes / 1e6:.1f} MB, "
+            f"{self.retries} retries ({self.errors} connection errors), "
+            f"{mean_latency * 1000:.0f} ms mean latency"
+        )
+
+
+def retry_after(response: requests.Response) -> float | None:
+    """Reads the delay requested by the Retry-After header in seconds."""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+class Session:
+    """A pooled HTTP session with timeouts and retries.
+
+    Connections are kept alive and shared between threads. Failed requests
+    (connection errors, timeouts and `RETRY_STATUS_CODES`) are retried with an
+    exponential backoff, unless the server asks for a delay with Retry-After.
+    Requests are paced by a `Scheduler`, and a throttled request
+    (`THROTTLE_STATUS_CODES`) pauses and slows down all requests to the host.
+
+    Attributes:
+        timeout: The timeout of a request in seconds.
+        retries: The maximum number of retries of a request.
+        backoff: The delay before the first retry in seconds.
+        scheduler: The scheduler shared by all requests.
+        stats: The statistics of all requests.
+    """
+
+    def __init__(
+        self,
+        *,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        requests_per_second: float | None = DEFAULT_REQUESTS_PER_SECOND,
+        burst: int = DEFAULT_BURST,
+    ) -> None:
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.scheduler = Scheduler(requests_per_second, burst=burst)
+        self.stats = SessionStats()
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def get(self, url: str, *, headers: dict | None = None) -> requests.Response:
+        """Sends a GET request.
+
+        Raises:
+            requests.HTTPError: The last response has an error status code.
+            requests.RequestException: The last request failed.
+        """
+        for attempt in range(self.retries + 1):
+            delay = min(MAX_BACKOFF, self.backoff * 2**attempt)
+            last_attempt = attempt == self.retries
+
+            self.scheduler.wait(url)
+            start = time.perf_counter()
+            try:
+                response = self._session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    raise
+                self.stats.record_retry(error=True)
+                time.sleep(delay)
+                continue
+
+            self.stats.record(
+                n_bytes=len(response.content), latency=time.perf_counter() - start
+            )
+            if response.status_code in RETRY_STATUS_CODES and not last_attempt:
+                self.stats.record_retry()
+                requested = retry_after(response)
+                delay = delay if requested is None else min(MAX_BACKOFF, requested)
+                if response.status_code in THROTTLE_STATUS_CODES:
+                    self.scheduler.penalize(url, delay)
+                else:
+                    time.sleep(delay)
+                continue
+
+            if response.status_code not in THROTTLE_STATUS_CODES:
+                self.scheduler.reward(url)
+
+            response.raise_for_status()
+            return response
+
+    def close(self) -> None:
+        self._session.close()
+
+
+_session: Session | None = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> Session:
+    """Returns the session shared by all the requests to JPDB."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session()
+        return _session
@@ -0,0 +1,238 @@
+import os
+import pathlib
+import pickle
+import sqlite3
+import threading
+from typing import Iterable, NamedTuple
+
+from jpdb_anki import metrics
+from jpdb_anki.fields import note
+from jpdb_anki.parallel import batched
+
+# SQLite limits the number of parameters of a query
+MAX_QUERY_PARAMETERS = 500
+
+# 0: pickled notes, 1: notes in the binary format of `note.Note.to_bytes`,
+# 2: with the metadata index
+STORE_VERSION = 2
+
+
+def encode_note(note_: note.Note) -> bytes:
+    return note_.to_bytes()
+
+
+def decode_note(data: bytes) -> note.Note:
+    """Decodes a note in the binary format, or pickled by older versions."""
+    if data.startswith(note.NOTE_MAGIC):
+        return note.Note.from_bytes(data)
+    return pickle.loads(data)
+
+
+class NoteMetadata(NamedTuple):
+    expression: str
+    reading: str
+    frequency: int
+    part_of_speech: str
+
+
+def note_metadata(note_: note.Note) -> NoteMetadata:
+    return NoteMetadata(
+        note_.expression,
+        note_.reading,
+        note_.frequency,
+        getattr(note_, "part_of_speech", ""),
+    )
+
+
+class NoteStore:
+    """A single-file note store indexed by note key.
+
+    Notes are serialized with `note.Note.to_bytes` in a SQLite table whose
+    primary key is the note key. Bulk reads and writes run in a single
+    transaction. Stores of older versions are converted when opened.
+
+    The metadata of each note (expression, reading, frequency and part of
+    speech) is indexed with the note, and the entries of vocabulary lists are
+    indexed by list, so that notes can be filtered and sorted without being
+    loaded.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS notes "
+                "(key TEXT PRIMARY KEY, data BLOB NOT NULL) WITHOUT ROWID"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, "
+                "expression TEXT NOT NULL, reading TEXT NOT NULL, "
+                "frequency INTEGER NOT NULL, part_of_speech TEXT NOT NULL) "
+                "WITHOUT ROWID"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS list_entries (list TEXT NOT NULL, "
+                "key TEXT NOT NULL, PRIMARY KEY (list, key)) WITHOUT ROWID"
+            )
+        if self.version < STORE_VERSION:
+            self.upgrade()
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def upgrade(self) -> int:
+        """Converts the notes of an older store version, by batches.
+
+        Pickled notes are converted to the binary format, and the metadata
+        of every note is indexed.
+
+        Returns:
+            The number of converted notes.
+        """
+        n_notes = 0
+        for keys in batched(self.keys(), MAX_QUERY_PARAMETERS):
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT key, data FROM notes WHERE key IN (%s)"
+                    % ",".join("?" * len(keys)),
+                    keys,
+                ).fetchall()
+            items = [(key, decode_note(data)) for key, data in rows]
+            self.put_many(items)
+            n_notes += len(items)
+
+        with self._lock, self._connection:
+            self._connection.execute(f"PRAGMA user_version = {STORE_VERSION}")
+        if n_notes:
+            print(n_notes, "notes converted to the store version", STORE_VERSION)
+        return n_notes
+
+    def keys(self) -> list[str]:
+        """The keys of all notes, in a stable order."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key FROM notes ORDER BY key"
+            ).fetchall()
+        return [key for key, in rows]
+
+    def get(self, key: str) -> note.Note:
+        """Loads a note.
+
+        Raises:
+            KeyError: The note is not in the store.
+        """
+        notes = self.get_many([key])
+        if key not in notes:
+            raise KeyError(key)
+        return notes[key]
+
+    @metrics.timed("store.get_many")
+    def get_many(self, keys: Iterable[str]) -> dict[str, note.Note]:
+        """Loads notes, missing notes are left out of the result."""
+        rows = []
+        with self._lock:
+            for batch in batched(keys, MAX_QUERY_PARAMETERS):
+                rows += self._connection.execute(
+                    "SELECT key, data FROM notes WHERE key IN (%s)"
+                    % ",".join("?" * len(batch)),
+                    batch,
+                ).fetchall()
+        return {key: decode_note(data) for key, data in rows}
+
+    def put(self, key: str, note_: note.Note) -> None:
+        self.put_many([(key, note_)])
+
+    @metrics.timed("store.put_many")
+    def put_many(self, items: Iterable[tuple[str, note.Note]]) -> None:
+        """Saves notes in a single transaction, overwriting existing ones."""
+        items = list(items)
+        rows = [(key, encode_note(note_)) for key, note_ in items]
+        metadata = [(key, *note_metadata(note_)) for key, note_ in items]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO notes (key, data) VALUES (?, ?)", rows
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)", metadata
+            )
+
+    def metadata(self, keys: Iterable[str] | None = None) -> dict[str, NoteMetadata]:
+        """Reads the metadata of notes, or of all the notes if keys is None.
+
+        Missing notes are left out of the result.
+        """
+        query = (
+            "SELECT key, expression, reading, frequency, part_of_speech FROM metadata"
+        )
+        rows = []
+        with self._lock:
+            if keys is None:
+                rows = self._connection.execute(query).fetchall()
+            else:
+                for batch in batched(keys, MAX_QUERY_PARAMETERS):
+                    rows += self._connection.execute(
+                        query + " WHERE key IN (%s)" % ",".join("?" * len(batch)),
+                        batch,
+                    ).fetchall()
+        return {key: NoteMetadata(*values) for key, *values in rows}
+
+    def put_list(self, list_: str, keys: Iterable[str]) -> None:
+        """Indexes the note keys of the entries of a vocabulary list."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM list_entries WHERE list = ?", (list_,)
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO list_entries (list, key) VALUES (?, ?)",
+                [(list_, key) for key in keys],
+            )
+
+    def list_keys(self, list_: str) -> set[str]:
+        """The note keys of the entries of an indexed vocabulary list."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key FROM list_entries WHERE list = ?", (list_,)
+            ).fetchall()
+        return {key for key, in rows}
+
+    def lists(self) -> set[str]:
+        """The indexed vocabulary lists."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT list FROM list_entries"
+            ).fetchall()
+        return {list_ for list_, in rows}
+
+    def migrate_directory(self, directory: str) -> int:
+        """Moves the notes of a directory of pickles into the store.
+
+        The directory is renamed with a `.migrated` suffix once its notes are
+        saved. Unreadable pickles are skipped.
+
+        Returns:
+            The number of migrated notes.
+        """
+        n_notes = 0
+        for keys in batched(sorted(os.listdir(directory)), MAX_QUERY_PARAMETERS):
+            items = []
+            for key in keys:
+                try:
+                    with open(os.path.join(directory, key), "rb") as file:
+                        items.append((key, pickle.load(file)))
+                except (pickle.UnpicklingError, EOFError, AttributeError) as e:
+                    print("Skipping unreadable note", key, f"({e!r})")
+            self.put_many(items)
+            n_notes += len(items)
+
+        os.rename(directory, directory.rstrip(os.sep) + ".migrated")
+        return n_notes
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()